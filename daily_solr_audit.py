@@ -14,38 +14,110 @@ cwd = socket.getfqdn() + os.path.abspath(sys.argv[0])
 # Get command line options if any
 arg_dict = processArgs(sys.argv[1:])
 
-# For multiple sources, Solr query is executed only on first iteration if 
-# sources have the same query URL
-solr_query_done = False
-solr_query_url = None
+# For multiple sources, Solr query is executed only once for each query URL
+# (including filter query), or once for sources splitting a full export
+solr_exports = {}
+solr_split_checked = set()
 
 # Load settings from params file
-for source_settings in p.config:
-    source = Datasource(source_settings)
+sources = [Datasource(source_settings) for source_settings in p.config]
+
+# Catalog files already on disk if catalog has not been created
+for source in sources:
+    confirmDir(source.catalog_path)
+    catalog_file = source.catalog_path + source.catalog_file
+    if not os.path.exists(catalog_file):
+        rebuildCatalog(catalog_file, \
+                           [s for s in sources \
+                                if s.catalog_path + s.catalog_file == \
+                                catalog_file])
+
+# Notification emails to resend for -r option, by email server
+resend_files = {}
+
+for source in sources:
+    catalog_file = source.catalog_path + source.catalog_file
     # Process command line arguments
     if arg_dict['source']:
         if arg_dict['source'].lower() != source.name.lower():
             continue
     if arg_dict['resend']:
-        # resend notification emails for -r date
-        resendEmail(source.name, source.email_filename, \
-                        source.email_server, arg_dict['resend'], \
-                        source.email_path, source.archive_path)
+        # Find notification emails for -r date(s) to resend after all sources
+        email_files = [entry['path'] + f for (f, entry) in \
+                           findArtifacts(loadCatalog(catalog_file), \
+                                             source.name, \
+                                             getDateRange(arg_dict['resend']), \
+                                             'email')]
+        if not email_files:
+            print 'No emails found from %s for %s.' % (source.name, \
+                                                           arg_dict['resend'])
+        resend_files.setdefault(source.email_server, []).extend(email_files)
+        continue
+    if arg_dict['outputs']:
+        # List output files for -o date(s)
+        artifacts = findArtifacts(loadCatalog(catalog_file), source.name, \
+                                      getDateRange(arg_dict['outputs']))
+        print formatArtifacts(source.name, artifacts) + '\n'
+        continue
+    # Bib history store is disabled if history_file is None
+    if source.history_file is not None:
+        history_file = source.history_path + source.history_file
+    else:
+        history_file = None
+    if arg_dict['bib'] or arg_dict['compact']:
+        if history_file is None:
+            print 'No bib history kept for %s.' % source.name
+            continue
+        confirmDir(source.history_path)
+        if arg_dict['bib']:
+            # Show audit history of -b bib ids
+            history = queryHistory(history_file, source.name, \
+                                       getBibList(arg_dict['bib']))
+            print '%s\n\n%s\n' % (source.name.upper(), formatTabularData( \
+                    [['bib_id', 'audit date', 'action', 'outcome', \
+                          'solr_last_updated']] + history))
+        if arg_dict['compact']:
+            # Remove bib history older than history_keep_days
+            removed = compactHistory(history_file, source.name, \
+                                         source.history_keep_days)
+            print 'Removed %d bib history rows from %s.' % (removed, \
+                                                                source.name)
         continue
     if arg_dict['date']:
         source.alternate_date = setDate(arg_dict['date'])
+        # Reruns for -d date query Solr afresh instead of using snapshot cache
+        source.solr_cache_ttl = None
     if arg_dict['viz']:
         source.viz_output = arg_dict['viz']
+    # Load checkpoint of incomplete audit to resume for -c date
+    if arg_dict['resume']:
+        resume_date = setDate(arg_dict['resume'])
+        checkpoint_file = findCheckpoint(source.checkpoint_path, source.name, \
+                                             resume_date)
+        if checkpoint_file is None:
+            print 'No incomplete audit found from %s for %s.' \
+                % (source.name, arg_dict['resume'])
+            continue
+        checkpoint = loadCheckpoint(checkpoint_file)
+        source.alternate_date = checkpoint['alternate_date']
+    else:
+        checkpoint = {'stages': []}
 
     # Filename addition to indicate alternate date if set
     if source.alternate_date is not None:
         add_alt = '.' + ''.join(getDate(source.alternate_date)) + 'ALT'
+        alt = 'ALT'
     else:
         add_alt = ''
+        alt = ''
 
     # Check that directories indicated in params exist, and create if necessary
     paths = set([source.log_path, source.stat_path, source.data_path, \
-                source.archive_path, source.email_path, source.viz_output_path])
+                source.archive_path, source.email_path, \
+                source.viz_output_path, source.solr_spool_path, \
+                source.checkpoint_path])
+    if history_file is not None:
+        paths.add(source.history_path)
     for path in paths:
         confirmDir(path)
     # File management - archive and delete older files
@@ -53,7 +125,7 @@ for source_settings in p.config:
                              source.email_path, source.viz_output_path)
     doFileRotation(source.rotation_data, path_dict, source.archive_path, \
                        source.email_server, source.email_sender, \
-                       source.email_recipients)
+                       source.email_recipients, catalog_file)
 
     # If log and/or stats files do not exist or are empty, create files and/or 
     # write header line.
@@ -69,203 +141,484 @@ for source_settings in p.config:
         with open(filename, 'a+') as fh:
             if not fh.readline():
                 fh.write('\t'.join(header) + '\n')
-    # Set default audit status for notification email subject line
-    status = 'OK'
     # Get date of audit (default is today, set params.alternate_date or use 
-    # command line option -d YYYYMMDD to override)
-    audit_date = getDateString(source.alternate_date)
-    # Set filename patterns to select files for audit date
-    regex_dict = dict((k, substituteDate(audit_date, v)) \
-                  for (k, v) in source.input_filenames.iteritems())
-    # Create lists to store audit date's filenames
-    file_dict = dict((k, []) for k in regex_dict.iterkeys())
-    # Get input files already audited today
-    # Returns dictionary of empty values if alternate date is set
-    processed_files = getProcessedFiles(source.log_path, source.log_file, \
-                                            source.alternate_date, regex_dict)
-    # Get matching filenames and add to lists
-    # f=filename, k=key in regex_dict and file_dict, v=regex patt in regex_dict
-    for f in os.listdir(source.input_path):
-        for k, v in regex_dict.iteritems():
-            if re.match(v, f) and f not in processed_files[k]:
-                file_dict[k].append(f)
-    # Log file names identified; if no files to process, write to output if
-    # indicated in params and proceed to next source
-    timestamp = str(datetime.datetime.now()).split('.')[0]
-    input_found = False
-    log_data = [log_header]
-    for action, files in file_dict.iteritems():
-        # If files were identified, write to log
-        if files:
-            input_found = True
-            for filename in files:
-                log_data.append([timestamp, audit_date, filename])
-        # If no files were identified, write to log if conditions met
-        else:
-            # Write to log if alternate_date is set to a value
-            if source.alternate_date is not None:
-                status = 'NO FILES FOUND'
-                error_msg = 'no %s %s files found' % (source.name, action)
-            # Write to log if log_if_none is set to True
-            elif source.log_if_none is True:
-                status = 'NO NEW FILES FOUND'
-                error_msg = 'no new %s %s files found' % (source.name, action)
-            # Otherwise, continue to next action with no output
+    # command line option -d YYYYMMDD to override; date of checkpoint if 
+    # resuming with -c YYYYMMDD)
+    if arg_dict['resume']:
+        audit_date = resume_date
+        stale_checkpoints = []
+    else:
+        audit_date = getDateString(source.alternate_date)
+        # Incomplete audits for the same date are replaced by this audit, 
+        # unless already logged (rerunning would repeat stats, log and email)
+        stale_checkpoints = findCheckpoints(source.checkpoint_path, \
+                                                source.name, audit_date)
+        if any('log' in getCheckpointStages(f) for f in stale_checkpoints):
+            print 'Incomplete audit from %s for %s already logged; not ' \
+                'rerun (use -c).' % (source.name, audit_date)
+            continue
+        if stale_checkpoints:
+            print 'Incomplete audit from %s for %s not resumed (use -c); ' \
+                'replaced by this audit.' % (source.name, audit_date)
+        # Stages completed by an audit are saved to a checkpoint file, which
+        # is removed when the audit finishes
+        checkpoint_file = getCheckpointFile(source.checkpoint_path, \
+                                                source.name, audit_date)
+    if 'files' in checkpoint['stages']:
+        file_dict = checkpoint['file_dict']
+        processed_files = checkpoint['processed_files']
+        log_data = checkpoint['log_data']
+        timestamp = checkpoint['timestamp']
+        status = checkpoint['status']
+    else:
+        # Set default audit status for notification email subject line
+        status = 'OK'
+        # Set filename patterns to select files for audit date
+        regex_dict = dict((k, substituteDate(audit_date, v)) \
+                      for (k, v) in source.input_filenames.iteritems())
+        # Create lists to store audit date's filenames
+        file_dict = dict((k, []) for k in regex_dict.iterkeys())
+        # Get input files already audited today
+        # Returns dictionary of empty values if alternate date is set
+        processed_files = getProcessedFiles(source.log_path, \
+                                                source.log_file, \
+                                                source.alternate_date, \
+                                                regex_dict)
+        # Get matching filenames and add to lists
+        # f=filename, k=key in regex_dict and file_dict, v=regex patt in 
+        # regex_dict
+        for f in os.listdir(source.input_path):
+            for k, v in regex_dict.iteritems():
+                if re.match(v, f) and f not in processed_files[k]:
+                    file_dict[k].append(f)
+        # Log file names identified
+        timestamp = str(datetime.datetime.now()).split('.')[0]
+        log_data = [log_header]
+        for action, files in file_dict.iteritems():
+            # If files were identified, write to log
+            if files:
+                for filename in files:
+                    log_data.append([timestamp, audit_date, filename])
+            # If no files were identified, write to log if conditions met
             else:
-                continue
-            log_data.append([timestamp, audit_date, error_msg.upper()])
+                # Write to log if alternate_date is set to a value
+                if source.alternate_date is not None:
+                    status = 'NO FILES FOUND'
+                    error_msg = 'no %s %s files found' % (source.name, action)
+                # Write to log if log_if_none is set to True
+                elif source.log_if_none is True:
+                    status = 'NO NEW FILES FOUND'
+                    error_msg = 'no new %s %s files found' \
+                        % (source.name, action)
+                # Otherwise, continue to next action with no output
+                else:
+                    continue
+                log_data.append([timestamp, audit_date, error_msg.upper()])
+        saveCheckpoint(checkpoint_file, checkpoint, 'files', \
+                           alternate_date=source.alternate_date, \
+                           file_dict=file_dict, \
+                           processed_files=processed_files, \
+                           log_data=log_data, timestamp=timestamp, \
+                           status=status)
+    input_found = any(file_dict.itervalues())
+    # Recheck bibs not added or not deleted in previous audits with targeted
+    # Solr queries, and record results in stats; skipped when the run has no
+    # other output
+    outstanding_file = source.log_path + source.outstanding_file
+    if 'recheck' in checkpoint['stages']:
+        outstanding_stats = checkpoint['outstanding_stats']
+        outstanding_notes = checkpoint['outstanding_notes']
+    elif input_found == False and source.log_if_none is not True:
+        outstanding_stats, outstanding_notes = [], []
+    else:
+        outstanding = loadOutstanding(outstanding_file)
+        outstanding_counts = recheckOutstanding(outstanding, \
+                                                    source.solr_url, \
+                                                    source.solr_timeout, \
+                                                    source.outstanding_max_age)
+        saveOutstanding(outstanding_file, outstanding)
+        outstanding_stats, outstanding_notes = \
+            formatOutstanding(timestamp, audit_date + alt, source.name, \
+                                  outstanding_counts)
+        saveCheckpoint(checkpoint_file, checkpoint, 'recheck', \
+                           outstanding_stats=outstanding_stats, \
+                           outstanding_notes=outstanding_notes)
+    # If no files to process, write to output if indicated in params and 
+    # proceed to next source
     if input_found == False:
-        # Write to log and email if condition met; otherwise, no output
+        # Write to log, stats and email if condition met; otherwise, no output
         if source.log_if_none is True:
+            appendOutput(outstanding_stats, source.stat_path, \
+                             source.stat_file)
             # Write to log, omitting headers
             appendOutput(log_data[1:], source.log_path, source.log_file)
             # Write and send email notification
             subject, report = formatReport(audit_date, source.name, status, \
-                                               cwd, log=log_data)
+                                               cwd, log=log_data, \
+                                               notes=outstanding_notes)
             msg = writeEmail(source.email_server, source.email_sender, \
                            source.email_recipients, subject, report)
-            writeEmailToFile(source.log_path, source.email_filename, '.email', \
-                                 msg)
+            email_file = writeEmailToFile(source.log_path, \
+                                              source.email_filename, '.email', \
+                                              msg)
+            catalogArtifacts(catalog_file, source.name, 'email', \
+                                 source.log_path, [email_file])
+        for f in [checkpoint_file] + stale_checkpoints:
+            clearCheckpoint(f)
         continue
 
-    # Get bib ids of records added, suppressed, deleted from extract files
-    bibs_by_file = {}
-    bibs_by_file['add'] = getBibsFromMarc(source.input_path, file_dict['add'], \
-                                              mfhd=source.skip_MFHDs)
-    bibs_by_file['suppress'] = getBibsFromText(source.input_path, \
-                                                   file_dict['suppress'], \
-                                                   source.bib_pattern)
-    bibs_by_file['delete'] = getBibsFromText(source.input_path, \
-                                                 file_dict['delete'], \
-                                                 source.bib_pattern)
-    # Get bib ids of records previously processed
-    # Returns empty dictionary if alternate date is set
-    processed_bibs = getProcessedBibs(source.input_path, processed_files, \
-                                          file_dict, source.skip_MFHDs, \
-                                          source.alternate_date, \
-                                          source.bib_pattern)
-    # Remove bib ids from current sets
-    # Consolidate sets for comparison to Solr
-    source_bibs = {}
-    for action in bibs_by_file.iterkeys():
-        bibs_by_file[action] = removeProcessedBibs(bibs_by_file[action], \
-                                                       processed_bibs[action])
-        source_bibs[action] = combineSets(bibs_by_file[action])
-    # Query Solr if not already done with same URL for previous source
-    if not solr_query_done or solr_query_url != source.solr_url:
-        solr_data = querySolr(source.solr_url)
-        solr_bibs = set(solr_data.keys())
-        solr_query_done = True
-        solr_query_url = source.solr_url
-
-    # Create dictionaries for results
-    solr_success = (dict((k, set()) for k in file_dict.iterkeys()))
-    solr_error = (dict((k, set()) for k in file_dict.iterkeys()))
-
-    # Check whether bibs in add lists are present and timestamped with audit
-    # date
-    for bib in source_bibs['add']:
-        # success
-        if bib in solr_bibs and solr_data[bib] >= audit_date:
-            solr_success['add'].add(bib)
-        # error
-        else:
-            solr_error['add'].add(bib)
+    # Unsuccessful bibs are verified with real-time get if set in params
+    if source.solr_verify_wait is not None:
+        verify_url = source.solr_url
+    else:
+        verify_url = None
 
-    # Check whether bibs in suppressed/deleted lists are not present in Solr
-    # success
-    solr_success['suppress'] = source_bibs['suppress'].difference(solr_bibs)
-    solr_success['delete'] = source_bibs['delete'].difference(solr_bibs)
-    # error
-    solr_error['suppress'] = source_bibs['suppress'].intersection(solr_bibs)
-    solr_error['delete'] = source_bibs['delete'].intersection(solr_bibs)
+    # Stream extract files through comparison to Solr without building sets 
+    # of all extract bibs first, if set in params (not used with sampling)
+    streaming = source.streaming and source.sample_min_extract is None
 
-    # Dictionary of results, folding suppressions into deletions
-    solr_results = {
-        'solr_added': solr_success['add'],
-        'solr_deleted': solr_success['suppress'].union(solr_success['delete']),
-        'solr_not_added': solr_error['add'],
-        'solr_not_deleted': solr_error['suppress'].union(solr_error['delete'])
-        }
     # Dictionary of headers for data files
     data_headers = {
         'solr_added': ['bib_id', 'solr_last_updated'],
         'solr_deleted': ['bib_id'],
         'solr_not_added': ['bib_id', 'solr_last_updated'],
         'solr_not_deleted': ['bib_id', 'solr_last_updated']}
+    if source.data_by_file:
+        data_headers = dict((k, ['bib_id', 'solr_last_updated', \
+                                     'extract_file']) \
+                                for k in data_headers.iterkeys())
 
-    # Write bibs processed to data files corresponding to source/action/outcome
-    # Determine output based on params settings and audit results
-    # add_alt is empty string if source.alternate_date is None
-    data_files = dict((k, (getFileNameTimestamp(v[0] + add_alt, '.bib.txt'), \
-                           v[1])) \
-                          for (k, v) in source.data_filenames.iteritems() \
-                          if solr_results[k])
-    writeBibsToLogs(solr_data, solr_results, source.data_path, data_files, \
-                        data_headers)
+    if not streaming:
+        if 'parse' in checkpoint['stages']:
+            bibs_by_file = checkpoint['bibs_by_file']
+        else:
+            # Get bib ids of records added, suppressed, deleted from extract 
+            # files
+            bibs_by_file = {}
+            bibs_by_file['add'] = getBibsFromMarc(source.input_path, \
+                                                      file_dict['add'], \
+                                                      mfhd=source.skip_MFHDs)
+            bibs_by_file['suppress'] = \
+                getBibsFromText(source.input_path, file_dict['suppress'], \
+                                    source.bib_pattern)
+            bibs_by_file['delete'] = getBibsFromText(source.input_path, \
+                                                         file_dict['delete'], \
+                                                         source.bib_pattern)
+            # Get bib ids of records previously processed
+            # Returns empty dictionary if alternate date is set
+            processed_bibs = getProcessedBibs(source.input_path, \
+                                                  processed_files, file_dict, \
+                                                  source.skip_MFHDs, \
+                                                  source.alternate_date, \
+                                                  source.bib_pattern)
+            # Remove bib ids from current sets
+            for action in bibs_by_file.iterkeys():
+                bibs_by_file[action] = \
+                    removeProcessedBibs(bibs_by_file[action], \
+                                            processed_bibs[action])
+            saveCheckpoint(checkpoint_file, checkpoint, 'parse', \
+                               bibs_by_file=bibs_by_file)
+        # Consolidate sets for comparison to Solr
+        source_bibs = dict((action, combineSets(file_sets)) \
+                               for (action, file_sets) \
+                               in bibs_by_file.iteritems())
+        # Index extract file of each bib for per-file stats and data files, 
+        # if needed
+        if source.viz_output == 'on' or source.data_by_file:
+            bib_index = indexBibsByFile(bibs_by_file)
 
-    # Generate audit stats for source
-    if source.alternate_date is not None:
-        alt = 'ALT'
+    # Verify a random sample from each extract file with targeted Solr queries
+    # instead of the full Solr export if extracts are large enough; run full 
+    # audit if estimated error rate is too high
+    if 'sample' in checkpoint['stages']:
+        sample = checkpoint['sample']
+    elif streaming:
+        sample = None
     else:
-        alt = ''
-    stat_data = [
-        stat_header,
-        [timestamp, audit_date + alt, source.name, 'ADD', 
-         str(len(source_bibs['add'])), 
-         str(len(solr_results['solr_added'])), 
-         str(len(solr_results['solr_not_added']))],
-        [timestamp, audit_date + alt, source.name, 'DEL', 
-         str(len(source_bibs['suppress'].union(source_bibs['delete']))), 
-         str(len(solr_results['solr_deleted'])), 
-         str(len(solr_results['solr_not_deleted']))]
-    ]
+        sample = None
+        extract_size = sum(len(bibs) for bibs in source_bibs.itervalues())
+        if source.sample_min_extract is not None and \
+                extract_size >= source.sample_min_extract:
+            sample = sampleAudit(bibs_by_file, source.solr_url, audit_date, \
+                                     source.name + audit_date, \
+                                     source.sample_size, \
+                                     source.sample_max_error_rate, \
+                                     source.solr_timeout)
+        saveCheckpoint(checkpoint_file, checkpoint, 'sample', sample=sample)
+    if sample is not None:
+        sampled = not sample['escalate']
+        sample_stats, sample_notes = formatSample(timestamp, \
+                                                      audit_date + alt, \
+                                                      source.name, sample)
+    else:
+        sampled = False
+        sample_stats, sample_notes = [], []
+
+    # Solr dataset is needed until data files are written
+    if streaming:
+        solr_needed = 'stream' not in checkpoint['stages']
+    else:
+        solr_needed = not sampled and 'data' not in checkpoint['stages']
+    if solr_needed:
+        # Use Solr snapshot saved with checkpoint if resuming
+        if checkpoint.get('solr_snapshot') and \
+                os.path.exists(checkpoint['solr_snapshot']):
+            solr_data = SolrSnapshot(checkpoint['solr_snapshot'])
+        else:
+            solr_source_url = getScopedSolrUrl(source.solr_url, \
+                                                   source.solr_filter)
+            # Split one export between sources with filters for the same 
+            # Solr URL if cheaper than exporting each filtered query
+            split_key = (source.solr_url, repr(source.solr_shards))
+            if solr_source_url not in solr_exports and source.solr_filter \
+                    and source.bib_pattern \
+                    and split_key not in solr_split_checked:
+                solr_split_checked.add(split_key)
+                partitions = dict((getScopedSolrUrl(s.solr_url, \
+                                                        s.solr_filter), \
+                                       s.bib_pattern) for s in sources \
+                                      if s.solr_url == source.solr_url and \
+                                      s.solr_shards == source.solr_shards \
+                                      and s.solr_filter and s.bib_pattern \
+                                      and (not arg_dict['source'] or \
+                                               arg_dict['source'].lower() == \
+                                               s.name.lower()))
+                solr_exports.update( \
+                    getSolrPartitions(source.solr_url, partitions, \
+                                          source.solr_spool_path, \
+                                          source.solr_timeout, \
+                                          source.solr_retries, \
+                                          source.solr_shards, \
+                                          source.solr_shard_threads, \
+                                          source.solr_cache_ttl, \
+                                          source.solr_split_share))
+            if solr_source_url not in solr_exports:
+                solr_exports[solr_source_url] = \
+                    getSolrSnapshot(solr_source_url, source.solr_spool_path, \
+                                        source.solr_timeout, \
+                                        source.solr_retries, \
+                                        source.solr_shards, \
+                                        source.solr_shard_threads, \
+                                        source.solr_cache_ttl)
+            solr_data = solr_exports[solr_source_url]
+            solr_snapshot = linkSnapshot(solr_data, checkpoint_file)
+            saveCheckpoint(checkpoint_file, checkpoint, 'solr', \
+                               solr_snapshot=solr_snapshot)
+
+    if streaming:
+        if 'stream' in checkpoint['stages']:
+            summary = checkpoint['summary']
+        else:
+            # Compare each extract file to Solr as it is read and write 
+            # results to data files, omitting bibs processed earlier today
+            processed_bibs = getProcessedBibs(source.input_path, \
+                                                  processed_files, file_dict, \
+                                                  source.skip_MFHDs, \
+                                                  source.alternate_date, \
+                                                  source.bib_pattern)
+            bib_streams = iterExtractBibs(source.input_path, file_dict, \
+                                              source.skip_MFHDs, \
+                                              source.bib_pattern)
+            # add_alt is empty string if source.alternate_date is None
+            data_files = dict((k, (getFileNameTimestamp(v[0] + add_alt, \
+                                                            '.bib.txt'), \
+                                       v[1])) \
+                                  for (k, v) \
+                                  in source.data_filenames.iteritems())
+            # Outstanding bibs resolved by this audit are retired from ledger
+            watch = set(bib for (bib, action) \
+                            in loadOutstanding(outstanding_file))
+            summary = streamComparison(bib_streams, solr_data, audit_date, \
+                                           source.data_path, data_files, \
+                                           data_headers, \
+                                           processed_bibs=processed_bibs, \
+                                           watch=watch, \
+                                           by_file=source.data_by_file, \
+                                           history_file=history_file, \
+                                           source_name=source.name, \
+                                           verify_url=verify_url, \
+                                           timeout=source.solr_timeout, \
+                                           verify_wait= \
+                                               source.solr_verify_wait, \
+                                           verify_interval= \
+                                               source.solr_verify_interval)
+            saveCheckpoint(checkpoint_file, checkpoint, 'stream', \
+                               summary=summary)
+        # Results hold unsuccessful bibs, and successful bibs only if 
+        # outstanding from previous audits
+        solr_results = summary['results']
+        result_counts = summary['counts']
+        extract_counts = summary['extract']
+        verified = summary['verified']
+    else:
+        if sampled:
+            solr_data = sample['data']
+            solr_success = sample['success']
+            solr_error = sample['error']
+        elif 'compare' in checkpoint['stages']:
+            solr_success = checkpoint['solr_success']
+            solr_error = checkpoint['solr_error']
+        else:
+            # Check whether bibs in add lists are present and timestamped with
+            # audit date, and bibs in suppressed/deleted lists are not present
+            solr_success, solr_error = compareToSolr(source_bibs, solr_data, \
+                                                         audit_date)
+            saveCheckpoint(checkpoint_file, checkpoint, 'compare', \
+                               solr_success=solr_success, \
+                               solr_error=solr_error)
 
-    # Update audit status for notification email subject line
-    # Action unsuccessful
-    if solr_results['solr_not_added'] or solr_results['solr_not_deleted']:
-        status = 'REVIEW'
-    # Extract files found but empty
-    if len(source_bibs['add']) == 0 or \
-            len(source_bibs['suppress'].union(source_bibs['delete'])) == 0:
-        status = 'REVIEW'
+        if 'verify' in checkpoint['stages']:
+            # Checkpoint holds comparison before verification
+            verified = checkpoint['verified']
+            applyVerified(verified, solr_success, solr_error)
+        elif verify_url is not None and not sampled and \
+                any(solr_error.itervalues()):
+            # Re-query unsuccessful bibs once Solr has committed pending 
+            # updates, so only confirmed failures are reported
+            verified = verifyErrors(verify_url, solr_error, audit_date, \
+                                        source.solr_timeout, \
+                                        source.solr_verify_wait, \
+                                        source.solr_verify_interval)
+            applyVerified(verified, solr_success, solr_error)
+            # Only bibs moved are saved; comparison is saved once above
+            saveCheckpoint(checkpoint_file, checkpoint, 'verify', \
+                               verified=verified)
+        else:
+            verified = {}
 
-    # Write to log of files processed and cumulative stats file
-    # Omit headers
-    appendOutput(log_data[1:], source.log_path, source.log_file)
-    appendOutput(stat_data[1:], source.stat_path, source.stat_file)
+        # Dictionary of results, folding suppressions into deletions
+        solr_results = {
+            'solr_added': solr_success['add'],
+            'solr_deleted': solr_success['suppress'].union( \
+                solr_success['delete']),
+            'solr_not_added': solr_error['add'],
+            'solr_not_deleted': solr_error['suppress'].union( \
+                solr_error['delete'])
+            }
+        result_counts = dict((k, len(v)) for (k, v) in solr_results.iteritems())
+        extract_counts = {
+            'add': len(source_bibs['add']),
+            'del': len(source_bibs['suppress'].union(source_bibs['delete']))}
+
+    if 'data' in checkpoint['stages']:
+        data_files = checkpoint['data_files']
+    else:
+        if streaming:
+            # Data files were written during comparison
+            data_files = summary['data_files']
+        else:
+            # Write bibs processed to data files corresponding to 
+            # source/action/outcome
+            # Determine output based on params settings and audit results
+            # add_alt is empty string if source.alternate_date is None
+            data_files = dict((k, (getFileNameTimestamp(v[0] + add_alt, \
+                                                            '.bib.txt'), \
+                                       v[1])) \
+                                  for (k, v) \
+                                  in source.data_filenames.iteritems() \
+                                  if solr_results[k])
+            if source.data_by_file:
+                bib_files = {
+                    'solr_added': [bib_index['add']],
+                    'solr_deleted': [bib_index['suppress'], \
+                                         bib_index['delete']],
+                    'solr_not_added': [bib_index['add']],
+                    'solr_not_deleted': [bib_index['suppress'], \
+                                             bib_index['delete']]}
+            else:
+                bib_files = None
+            writeBibsToLogs(solr_data, solr_results, source.data_path, \
+                                data_files, data_headers, bib_files=bib_files, \
+                                history_file=history_file, \
+                                source_name=source.name, \
+                                audit_date=audit_date, verified=verified)
+        catalogArtifacts(catalog_file, source.name, 'bib.txt', \
+                             source.data_path, \
+                             [f[0] for f in data_files.itervalues()])
+
+        # Add errors to outstanding ledger for recheck on later runs
+        outstanding = loadOutstanding(outstanding_file)
+        updateOutstanding(outstanding, solr_results, audit_date)
+        saveOutstanding(outstanding_file, outstanding)
+        saveCheckpoint(checkpoint_file, checkpoint, 'data', \
+                           data_files=data_files)
+
+    if 'log' in checkpoint['stages']:
+        stat_data = checkpoint['stat_data']
+        status = checkpoint['status']
+    else:
+        # Generate audit stats for source
+        # Stats are estimated from sample if full audit was not run
+        if sampled:
+            stat_data = [stat_header] + sample_stats
+        else:
+            stat_data = [
+                stat_header,
+                [timestamp, audit_date + alt, source.name, 'ADD', 
+                 str(extract_counts['add']), 
+                 str(result_counts['solr_added']), 
+                 str(result_counts['solr_not_added'])],
+                [timestamp, audit_date + alt, source.name, 'DEL', 
+                 str(extract_counts['del']), 
+                 str(result_counts['solr_deleted']), 
+                 str(result_counts['solr_not_deleted'])]
+            ] + sample_stats
+        stat_data += outstanding_stats
+
+        # Update audit status for notification email subject line
+        # Action unsuccessful
+        if result_counts['solr_not_added'] or \
+                result_counts['solr_not_deleted']:
+            status = 'REVIEW'
+        # Extract files found but empty
+        if extract_counts['add'] == 0 or extract_counts['del'] == 0:
+            status = 'REVIEW'
+
+        # Write to log of files processed and cumulative stats file
+        # Omit headers
+        appendOutput(log_data[1:], source.log_path, source.log_file)
+        appendOutput(stat_data[1:], source.stat_path, source.stat_file)
+        saveCheckpoint(checkpoint_file, checkpoint, 'log', \
+                           stat_data=stat_data, status=status)
+
+    if 'email' not in checkpoint['stages']:
+        # Construct notification email with attachments, if any
+        # Send email to recipients in params
+        # Save email to backup file (to resend if necessary)
+        subject, report = formatReport(audit_date, source.name, status, cwd, \
+                                           log=log_data, stats=stat_data, \
+                                           notes=sample_notes + \
+                                           formatVerified(verified) + \
+                                           outstanding_notes)
+        files_to_attach = [source.data_path + f[0] \
+                               for f in data_files.values() if f[1] == True]
+        msg = writeEmail(source.email_server, source.email_sender, \
+                             source.email_recipients, subject, report, \
+                             attach=files_to_attach)
+        email_file = writeEmailToFile(source.log_path, \
+                                          source.email_filename + add_alt, \
+                                          '.email', msg)
+        catalogArtifacts(catalog_file, source.name, 'email', \
+                             source.log_path, [email_file])
+        saveCheckpoint(checkpoint_file, checkpoint, 'email')
 
-    # Construct notification email with attachments, if any
-    # Send email to recipients in params
-    # Save email to backup file (to resend if necessary)
-    subject, report = formatReport(audit_date, source.name, status, cwd, \
-                                       log=log_data, stats=stat_data)
-    files_to_attach = [source.data_path + f[0] for f in data_files.values() \
-                           if f[1] == True]
-    msg = writeEmail(source.email_server, source.email_sender, \
-                         source.email_recipients, subject, report, \
-                         attach=files_to_attach)
-    writeEmailToFile(source.log_path, source.email_filename + add_alt, \
-                         '.email', msg)
     # Add stats by extract file to database for use by visualization service
     # If filename is already in database, new data will overwrite old
     if source.viz_output == 'on':
         # Prepare data
-        viz_stat_data = {}
-        for action, file_sets in bibs_by_file.iteritems():
-            for f, bib_set in file_sets.iteritems():
-                viz_stat_data[f] = {action: {}}
-                viz_stat_data[f][action]['extract'] = len(bib_set)
-                viz_stat_data[f][action]['load'] = \
-                    len(bib_set.intersection(solr_success[action]))
-                viz_stat_data[f][action]['error'] = \
-                    len(bib_set.intersection(solr_error[action]))
-        # Structure data for SQL query
+        if streaming:
+            viz_stat_data = summary['file_stats']
+        else:
+            viz_stat_data = attributeResults(bib_index, solr_success, \
+                                                 solr_error, file_dict)
+            if sampled:
+                scaleSampleStats(viz_stat_data)
+        # Structure data for SQL query, by file and action
         viz_sql_data = {}
         viz_file_output = {}
         for action, filenames in file_dict.iteritems():
             for f in filenames:
-                viz_sql_data[f] = {
+                viz_sql_data[(f, action)] = {
                     'audit_date': audit_date, 
                     'timestamp': timestamp,
                     'resource': source.name,
@@ -276,5 +629,17 @@ for source_settings in p.config:
                     'filename': f}
         # Write to database and backup files
         queries = writeToDatabase(source.viz_output_db, viz_sql_data)
-        writeSQLToFile(source.viz_output_path, source.viz_output_filename, \
-                           add_alt, '.viz.sql', queries)
+        sql_files = writeSQLToFile(source.viz_output_path, \
+                                       source.viz_output_filename, add_alt, \
+                                       '.viz.sql', queries)
+        catalogArtifacts(catalog_file, source.name, 'viz.sql', \
+                             source.viz_output_path, sql_files)
+
+    # Audit complete
+    for f in [checkpoint_file] + stale_checkpoints:
+        clearCheckpoint(f)
+
+# Resend notification emails for -r option, one SMTP session per server
+for server, email_files in resend_files.iteritems():
+    if email_files:
+        resendEmail(server, email_files)
@@ -1,5 +1,8 @@
 #!/usr/bin/python
 
+import threading
+from contextlib import contextmanager
+
 class Datasource:
     """Interpret source settings from params."""
     def __init__(self, data):
@@ -10,6 +13,16 @@ class Datasource:
         self.skip_MFHDs = data['skip_MFHDs']
         self.bib_pattern = data['bib_pattern']
         self.solr_url = data['solr_url']
+        self.solr_timeout = data['solr_timeout']
+        self.solr_retries = data['solr_retries']
+        self.solr_spool_path = data['solr_spool_path']
+        self.solr_shards = data['solr_shards']
+        self.solr_shard_threads = data['solr_shard_threads']
+        self.solr_cache_ttl = data['solr_cache_ttl']
+        self.solr_filter = data['solr_filter']
+        self.solr_split_share = data['solr_split_share']
+        self.solr_verify_wait = data['solr_verify_wait']
+        self.solr_verify_interval = data['solr_verify_interval']
         self.log_path = data['log_path']
         self.log_file = data['log_file']
         self.log_if_none = data['log_if_none']
@@ -17,6 +30,13 @@ class Datasource:
         self.stat_file = data['stat_file']
         self.data_path = data['data_path']
         self.data_filenames = data['data_filenames']
+        self.data_by_file = data['data_by_file']
+        self.outstanding_file = data['outstanding_file']
+        self.outstanding_max_age = data['outstanding_max_age']
+        self.sample_min_extract = data['sample_min_extract']
+        self.sample_size = data['sample_size']
+        self.sample_max_error_rate = data['sample_max_error_rate']
+        self.streaming = data['streaming']
         self.archive_path = data['archive_path']
         self.email_path = data['email_path']
         self.email_filename = data['email_filename']
@@ -28,6 +48,12 @@ class Datasource:
         self.viz_output_path = data['viz_output_path']
         self.viz_output_filename = data['viz_output_filename']
         self.rotation_data = data['rotation_data']
+        self.catalog_path = data['catalog_path']
+        self.catalog_file = data['catalog_file']
+        self.checkpoint_path = data['checkpoint_path']
+        self.history_path = data['history_path']
+        self.history_file = data['history_file']
+        self.history_keep_days = data['history_keep_days']
 
 def getDate(alternate_date):
     """Process current or alternate date for use as audit date."""
@@ -63,18 +89,878 @@ def substituteDate(audit_date, text):
     date_dict = {'YYYY': year, 'MM': month, 'DD': day}
     return substituteMultiple(date_dict, text)
 
-def querySolr(solr_url):
-    """Query the Solr index based on parameters in solr_url."""
-    import urllib2
+def querySolr(solr_url, spool_path, timeout=300, retries=3, shards=None, \
+                  threads=4):
+    """Query the Solr index based on parameters in solr_url.
+
+    The response is downloaded to a spool file in spool_path, parsed from
+    disk once the download is complete and removed. If shards is set, each 
+    shard is exported separately (see queryShards). Return dictionary 
+    {bib: date}.
+    """
+    import os
+    if shards:
+        return queryShards(solr_url, shards, spool_path, timeout, retries, \
+                               threads)
+    spool_file = spool_path + getSpoolFileName(solr_url)
+    try:
+        downloadSolr(solr_url, spool_file, timeout, retries)
+        return parseSolrFile(spool_file)
+    finally:
+        if os.path.exists(spool_file):
+            os.remove(spool_file)
+
+def queryShards(solr_url, shards, spool_path, timeout=300, retries=3, \
+                    threads=4):
+    """Export each shard of a SolrCloud collection in parallel with 
+    distrib=false and merge results.
+
+    shards is a list of core URLs or 'discover' to look up one active replica 
+    per shard from the cluster status. Return dictionary {bib: date}.
+    """
+    import os, Queue, threading
+    if shards == 'discover':
+        core_urls = getShardUrls(solr_url, timeout)
+    else:
+        core_urls = shards
+    shard_queue = Queue.Queue()
+    for core_url in core_urls:
+        shard_queue.put(getShardQueryUrl(solr_url, core_url))
+    spool_files = []
+    errors = []
+    def worker():
+        while True:
+            try:
+                shard_url = shard_queue.get_nowait()
+            except Queue.Empty:
+                return
+            spool_file = spool_path + getSpoolFileName(shard_url)
+            spool_files.append(spool_file)
+            try:
+                downloadSolr(shard_url, spool_file, timeout, retries)
+            except Exception as err:
+                errors.append((shard_url, err))
+    workers = [threading.Thread(target=worker) \
+                   for i in range(min(threads, len(core_urls)))]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    try:
+        if errors:
+            raise IOError('Solr shard export failed: %s' % \
+                              '; '.join('%s (%s)' % e for e in errors))
+        solr_data = {}
+        for spool_file in spool_files:
+            parseSolrFile(spool_file, solr_data)
+        return solr_data
+    finally:
+        for spool_file in spool_files:
+            if os.path.exists(spool_file):
+                os.remove(spool_file)
+
+def getShardUrls(solr_url, timeout=300):
+    """Get URL of one active replica core per shard from SolrCloud cluster 
+    status, preferring shard leaders."""
+    import json, urlparse
+    url = urlparse.urlsplit(solr_url)
+    # Path is /<solr root>/<collection>/<handler>
+    root, collection, handler = url.path.rsplit('/', 2)
+    status_url = urlparse.urlunsplit((url.scheme, url.netloc, \
+        root + '/admin/collections', \
+        'action=CLUSTERSTATUS&wt=json&collection=' + collection, ''))
+    response = requestSolr(status_url, timeout)
+    status = json.loads(''.join(readSolr(response)))
+    shards = status['cluster']['collections'][collection]['shards']
+    core_urls = []
+    for name in sorted(shards.iterkeys()):
+        replicas = [r for r in shards[name]['replicas'].itervalues() \
+                        if r.get('state') == 'active']
+        if not replicas:
+            raise IOError('No active replica for shard %s of %s' \
+                              % (name, collection))
+        replicas.sort(key=lambda r: r.get('leader') != 'true')
+        core_urls.append(replicas[0]['base_url'].rstrip('/') + '/' + \
+                             replicas[0]['core'])
+    return core_urls
+
+def getShardQueryUrl(solr_url, core_url):
+    """Construct non-distributed query URL for one shard core from solr_url."""
+    import urlparse
+    url = urlparse.urlsplit(solr_url)
+    handler = url.path.rsplit('/', 1)[1]
+    return core_url.rstrip('/') + '/' + handler + '?' + url.query + \
+        '&distrib=false'
+
+def getSpoolFileName(solr_url):
+    """Construct spool filename for Solr query results from URL hash and 
+    process id, so concurrent runs do not share a spool file."""
+    import hashlib, os
+    return 'solr_%s.%d.csv' % (hashlib.md5(solr_url).hexdigest()[:12], \
+                                   os.getpid())
+
+# Open HTTP connections by (scheme, host) for each thread, reused across 
+# requests
+_connections = threading.local()
+
+def getConnection(scheme, netloc, timeout):
+    """Return persistent HTTP connection to Solr host, opening if necessary."""
+    import httplib
+    pool = _connections.__dict__.setdefault('pool', {})
+    key = (scheme, netloc)
+    if key not in pool:
+        if scheme == 'https':
+            pool[key] = httplib.HTTPSConnection(netloc, timeout=timeout)
+        else:
+            pool[key] = httplib.HTTPConnection(netloc, timeout=timeout)
+    return pool[key]
+
+def dropConnection(scheme, netloc):
+    """Close and forget HTTP connection after a failed request."""
+    pool = _connections.__dict__.setdefault('pool', {})
+    conn = pool.pop((scheme, netloc), None)
+    if conn is not None:
+        conn.close()
+
+def requestSolr(solr_url, timeout=300, headers=None):
+    """Send GET request for solr_url over persistent connection.
+
+    Request gzip-compressed response. A reused connection that fails before 
+    a response is received is retried once on a new connection. Return 
+    response object; body must be read completely before connection is 
+    reused.
+    """
+    import httplib, socket, urlparse
+    url = urlparse.urlsplit(solr_url)
+    request_headers = {'Accept-Encoding': 'gzip', 'Connection': 'keep-alive'}
+    if headers:
+        request_headers.update(headers)
+    for attempt in range(2):
+        conn = getConnection(url.scheme, url.netloc, timeout)
+        reused = conn.sock is not None
+        try:
+            conn.request('GET', url.path + '?' + url.query, \
+                             headers=request_headers)
+            response = conn.getresponse()
+            break
+        except socket.timeout:
+            dropConnection(url.scheme, url.netloc)
+            raise
+        except (httplib.HTTPException, socket.error):
+            dropConnection(url.scheme, url.netloc)
+            # Server may have closed connection while idle since last 
+            # request; retry once on a new connection
+            if not reused or attempt:
+                raise
+        except Exception:
+            dropConnection(url.scheme, url.netloc)
+            raise
+    if response.status != 200:
+        response.read()
+        if response.status >= 500:
+            raise httplib.HTTPException('Solr returned HTTP %d for %s' \
+                                            % (response.status, solr_url))
+        raise IOError('Solr returned HTTP %d for %s' \
+                          % (response.status, solr_url))
+    return response
+
+def readSolr(response, chunk_size=1048576):
+    """Iterate over decompressed chunks of Solr response body."""
+    import httplib, zlib
+    if response.getheader('content-encoding', '').lower() == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    else:
+        decompressor = None
+    while True:
+        chunk = response.read(chunk_size)
+        if not chunk:
+            break
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        yield chunk
+    # Connection closed before declared Content-Length was received
+    if response.length:
+        raise httplib.IncompleteRead('', response.length)
+    if decompressor is not None:
+        yield decompressor.flush()
+
+def downloadSolr(solr_url, spool_file, timeout=300, retries=3):
+    """Stream CSV response for solr_url to spool_file, sorted by id.
+
+    If the connection drops, the partial last line is discarded and the query 
+    is resumed after the id of the last complete row with a range filter 
+    query, so rows are neither skipped nor repeated if the index changes 
+    between attempts. Return number of rows written.
+    """
+    import httplib, socket, time, urllib, urlparse, zlib
+    url = urlparse.urlsplit(solr_url)
+    query = [(k, v) for (k, v) in \
+                 urlparse.parse_qsl(url.query, keep_blank_values=True) \
+                 if k != 'sort'] + [('sort', 'id asc')]
+    rows = dict(query).get('rows')
+    rows_done = 0
+    last_id = None
+    header_done = False
+    attempt = 0
+    with open(spool_file, 'w+b') as fh:
+        while True:
+            # After first attempt, request rows after last id without CSV 
+            # header
+            if last_id is not None:
+                resume = [('start', '0'), ('csv.header', 'false'), 
+                          ('fq', 'id:{"%s" TO *]' % \
+                               last_id.replace('\\', '\\\\') \
+                               .replace('"', '\\"'))]
+                if rows is not None:
+                    resume.append(('rows', str(int(rows) - rows_done)))
+                request_query = [(k, v) for (k, v) in query \
+                                     if k not in ['start', 'rows']] + resume
+            else:
+                request_query = query
+            request_url = urlparse.urlunsplit((url.scheme, url.netloc, \
+                url.path, urllib.urlencode(request_query), url.fragment))
+            # Offset of end of last complete line in spool file
+            good_offset = fh.tell()
+            lines = 0
+            try:
+                response = requestSolr(request_url, timeout)
+                for chunk in readSolr(response):
+                    fh.write(chunk)
+                    n = chunk.count('\n')
+                    if n:
+                        lines += n
+                        good_offset = fh.tell() - \
+                            (len(chunk) - chunk.rindex('\n') - 1)
+                if fh.tell() != good_offset:
+                    fh.write('\n')
+                    lines += 1
+                if not header_done:
+                    lines -= 1
+                return rows_done + lines
+            except (httplib.HTTPException, socket.error, zlib.error):
+                dropConnection(url.scheme, url.netloc)
+                attempt += 1
+                if attempt > retries:
+                    raise
+                # Keep complete rows only
+                fh.seek(good_offset)
+                fh.truncate()
+                if lines and not header_done:
+                    header_done = True
+                    lines -= 1
+                rows_done += lines
+                if rows_done:
+                    last_id = getLastSpoolId(fh)
+                else:
+                    # No complete rows yet; start again from the beginning
+                    fh.seek(0)
+                    fh.truncate()
+                    header_done = False
+                time.sleep(2 ** attempt)
+
+def getLastSpoolId(fh, block_size=65536):
+    """Get id of last complete row in spool file, reading back from the end.
+    File position is left at the end."""
+    end = fh.tell()
+    pos = end
+    data = ''
+    while pos > 0 and data.count('\n') < 2:
+        size = min(block_size, pos)
+        pos -= size
+        fh.seek(pos)
+        data = fh.read(size) + data
+    fh.seek(end)
+    return data.rstrip('\n').rsplit('\n', 1)[-1].split(',')[0]
+
+def parseSolrFile(spool_file, solr_data=None, chunk_size=8388608):
+    """Parse spooled Solr CSV results in large chunks.
+
+    Results are added to solr_data if given. Return dictionary {bib: date}.
+    """
+    if solr_data is None:
+        solr_data = {}
+    with open(spool_file, 'rb') as fh:
+        header = fh.readline()
+        tail = ''
+        while True:
+            chunk = fh.read(chunk_size)
+            if not chunk:
+                break
+            lines = (tail + chunk).split('\n')
+            tail = lines.pop()
+            parseSolrLines(lines, solr_data)
+        parseSolrLines([tail], solr_data)
+    return solr_data
+
+def parseSolrLines(lines, solr_data):
+    """Add id and date from lines of Solr CSV results to solr_data."""
+    for line in lines:
+        fields = line.rstrip('\r').split(',')
+        if len(fields) > 1:
+            solr_data[fields[0]] = fields[1].split('T')[0]
+
+def querySolrIds(solr_url, bibs, timeout=300, batch_size=200):
+    """Look up bib ids with targeted queries on the id field, using the host 
+    and request handler of solr_url.
+
+    Return dictionary {bib: date} for bibs found in Solr.
+    """
+    import urllib, urlparse
+    url = urlparse.urlsplit(solr_url)
+    bibs = sorted(bibs)
     solr_data = {}
-    req = urllib2.Request(solr_url)
-    response = urllib2.urlopen(req)
-    header = response.readline()
-    for line in response:
-        fields = line.rstrip('\n').split(',')
-        solr_data[fields[0]] = fields[1].split('T')[0]
+    for i in range(0, len(bibs), batch_size):
+        batch = bibs[i:i + batch_size]
+        terms = ['"%s"' % b.replace('\\', '\\\\').replace('"', '\\"') \
+                     for b in batch]
+        query = urllib.urlencode([('q', 'id:(%s)' % ' OR '.join(terms)), \
+                                      ('fl', 'id,timestamp'), \
+                                      ('rows', str(len(batch))), \
+                                      ('wt', 'csv')])
+        response = requestSolr(urlparse.urlunsplit((url.scheme, url.netloc, \
+                                                        url.path, query, '')), \
+                                   timeout)
+        parseSolrLines(''.join(readSolr(response)).split('\n')[1:], solr_data)
     return solr_data
 
+def getHandlerUrl(solr_url, handler, query):
+    """Construct URL for another request handler of the core or collection in
+    solr_url, with query parameters from list of (name, value)."""
+    import urllib, urlparse
+    url = urlparse.urlsplit(solr_url)
+    path = url.path.rsplit('/', 1)[0] + '/' + handler
+    return urlparse.urlunsplit((url.scheme, url.netloc, path, \
+                                    urllib.urlencode(query), ''))
+
+def getIndexVersion(solr_url, timeout=300):
+    """Get version of the Solr index searched by solr_url, which changes with
+    each commit. Return None if the Luke handler is not available."""
+    import httplib, json
+    luke_url = getHandlerUrl(solr_url, 'admin/luke', \
+                                 [('show', 'index'), ('numTerms', '0'), \
+                                      ('wt', 'json')])
+    try:
+        response = requestSolr(luke_url, timeout)
+        return json.loads(''.join(readSolr(response)))['index']['version']
+    except (IOError, httplib.HTTPException, ValueError, KeyError):
+        return None
+
+def querySolrRealtime(solr_url, bibs, timeout=300, batch_size=200):
+    """Look up bib ids with real-time get, which includes documents indexed
+    but not yet committed, using the host and core or collection of solr_url.
+
+    Return dictionary {bib: date} for bibs found in Solr.
+    """
+    import json
+    bibs = sorted(bibs)
+    solr_data = {}
+    for i in range(0, len(bibs), batch_size):
+        batch = bibs[i:i + batch_size]
+        response = requestSolr(getHandlerUrl(solr_url, 'get', \
+                                                 [('ids', ','.join(batch)), \
+                                                      ('fl', 'id,timestamp'), \
+                                                      ('wt', 'json')]), \
+                                   timeout)
+        docs = json.loads(''.join(readSolr(response)))['response']['docs']
+        for doc in docs:
+            solr_data[doc['id']] = doc.get('timestamp', '').split('T')[0]
+    return solr_data
+
+def verifyErrors(solr_url, solr_error, audit_date, timeout=300, max_wait=60, \
+                     interval=10):
+    """Re-query unsuccessful bibs with real-time get to confirm errors that 
+    may be due to updates not yet committed when Solr was exported.
+
+    solr_error is dictionary {action: set(bibs)} as from compareToSolr. Bibs 
+    are checked at once, then again after waiting interval seconds, doubling 
+    each time, while each check finds more bibs successful, the index version 
+    (if available) shows new updates, and the total wait stays within 
+    max_wait seconds. Return dictionary {action: {bib: date}} of bibs now 
+    successful for that action, with empty date for suppressions and 
+    deletions.
+    """
+    import time
+    pending = dict((action, set(bibs)) \
+                       for (action, bibs) in solr_error.iteritems())
+    verified = dict((action, {}) for action in solr_error.iterkeys())
+    deadline = time.time() + max_wait
+    version = getIndexVersion(solr_url, timeout)
+    while True:
+        solr_data = querySolrRealtime(solr_url, combineSets(pending), timeout)
+        recovered = 0
+        for action, bibs in pending.iteritems():
+            for bib in list(bibs):
+                if isSolrUpdated(action, solr_data.get(bib), audit_date):
+                    verified[action][bib] = solr_data.get(bib, '')
+                    bibs.discard(bib)
+                    recovered += 1
+        # Real-time get includes uncommitted updates, so stop once a check 
+        # finds nothing more
+        if not recovered or not any(pending.itervalues()) or \
+                time.time() + interval > deadline:
+            break
+        time.sleep(interval)
+        # Stop waiting if no updates have been made since the last check
+        new_version = getIndexVersion(solr_url, timeout)
+        if new_version is not None and new_version == version:
+            break
+        version = new_version
+        interval *= 2
+    return verified
+
+def applyVerified(verified, solr_success, solr_error):
+    """Move bibs confirmed by verifyErrors from unsuccessful to successful 
+    sets for the same action only."""
+    for action, bibs in solr_error.iteritems():
+        moved = bibs.intersection(verified.get(action, {}))
+        solr_success[action].update(moved)
+        bibs.difference_update(moved)
+
+def formatVerified(verified):
+    """Format email notes for bibs confirmed by verifyErrors."""
+    count = sum(len(bibs) for bibs in verified.itervalues())
+    if not count:
+        return []
+    return ['VERIFIED: %d bibs unsuccessful in Solr export were found ' \
+                'successful by real-time get after Solr commits.' % count]
+
+def getSolrSnapshot(solr_url, spool_path, timeout=300, retries=3, \
+                        shards=None, threads=4, ttl=None):
+    """Get Solr query results from snapshot cache shared between processes.
+
+    If a snapshot for solr_url is younger than ttl seconds it is used; 
+    otherwise one process queries Solr and writes the snapshot while others 
+    wait on the lock. If ttl is None, Solr is queried without caching. Return 
+    SolrSnapshot, or dictionary {bib: date} if not cached.
+    """
+    if ttl is None:
+        return querySolr(solr_url, spool_path, timeout, retries, shards, \
+                             threads)
+    snapshot_file = getSnapshotFile(solr_url, spool_path, shards)
+    if not isFresh(snapshot_file, ttl):
+        with lockedFile(snapshot_file + '.lock'):
+            # Check again in case snapshot was written while waiting for lock
+            if not isFresh(snapshot_file, ttl):
+                solr_data = querySolr(solr_url, spool_path, timeout, \
+                                          retries, shards, threads)
+                writeSnapshot(snapshot_file, solr_data)
+                del solr_data
+    return SolrSnapshot(snapshot_file)
+
+def getSnapshotFile(solr_url, spool_path, shards=None):
+    """Construct snapshot cache filename from hash of normalized URL."""
+    import hashlib
+    key = hashlib.sha1(normalizeSolrUrl(solr_url) + repr(shards)).hexdigest()
+    return spool_path + 'solr_' + key[:16] + '.snap'
+
+def getScopedSolrUrl(solr_url, solr_filter):
+    """Add filter query solr_filter to solr_url so that only records for one 
+    source are exported."""
+    import urllib
+    if not solr_filter:
+        return solr_url
+    return solr_url + '&' + urllib.urlencode([('fq', solr_filter)])
+
+def countSolr(solr_url, timeout=300):
+    """Get number of records matching solr_url without exporting them."""
+    import json, urllib, urlparse
+    url = urlparse.urlsplit(solr_url)
+    query = [(k, v) for (k, v) in \
+                 urlparse.parse_qsl(url.query, keep_blank_values=True) \
+                 if k not in ['start', 'rows', 'fl', 'wt', 'indent']]
+    query += [('rows', '0'), ('wt', 'json')]
+    response = requestSolr(urlparse.urlunsplit((url.scheme, url.netloc, \
+                                                    url.path, \
+                                                    urllib.urlencode(query), \
+                                                    '')), timeout)
+    return json.loads(''.join(readSolr(response)))['response']['numFound']
+
+def getSolrPartitions(solr_url, partitions, spool_path, timeout=300, \
+                          retries=3, shards=None, threads=4, ttl=None, \
+                          min_share=0.9):
+    """Export solr_url once and split results between sources by bib id 
+    pattern instead of exporting each source's filtered query.
+
+    partitions is dictionary {filtered solr_url: bib_pattern}, with each 
+    pattern anchored at the end of the id when splitting. The single 
+    export is used if the filtered queries together match at least min_share 
+    of the records for solr_url, so little is transferred that no source 
+    needs. If ttl is set, each partition is written to the snapshot cache for 
+    its filtered URL. Return dictionary {filtered solr_url: SolrSnapshot or 
+    {bib: date}}, empty if filtered exports are cheaper.
+    """
+    import re
+    if len(partitions) < 2 or min_share is None:
+        return {}
+    if ttl is not None:
+        snapshot_files = dict((u, getSnapshotFile(u, spool_path, shards)) \
+                                  for u in partitions)
+        # Partitions already cached need no export
+        if all(isFresh(f, ttl) for f in snapshot_files.itervalues()):
+            return dict((u, SolrSnapshot(f)) \
+                            for (u, f) in snapshot_files.iteritems())
+    total = countSolr(solr_url, timeout)
+    scoped = sum(countSolr(u, timeout) for u in partitions)
+    if total == 0 or scoped < min_share * total:
+        return {}
+    solr_data = getSolrSnapshot(solr_url, spool_path, timeout, retries, \
+                                    shards, threads, ttl)
+    # Patterns must match whole ids, as Solr filter queries on id do
+    patterns = [(u, re.compile(r'(?:{0})$'.format(p))) \
+                    for (u, p) in partitions.iteritems()]
+    if ttl is None:
+        # Move records from export to partitions to limit peak memory
+        split = dict((u, {}) for u in partitions)
+        for bib in solr_data.keys():
+            date = solr_data.pop(bib)
+            for u, patt in patterns:
+                if patt.match(bib):
+                    split[u][bib] = date
+        return split
+    split = {}
+    for u, patt in patterns:
+        with lockedFile(snapshot_files[u] + '.lock'):
+            writeSnapshot(snapshot_files[u], \
+                              dict((bib, date) for (bib, date) \
+                                       in solr_data.iteritems() \
+                                       if patt.match(bib)))
+        split[u] = SolrSnapshot(snapshot_files[u])
+    return split
+
+def normalizeSolrUrl(solr_url):
+    """Normalize Solr URL for use as cache key: lowercase scheme and host, 
+    sort query parameters, ignore formatting-only parameters."""
+    import urllib, urlparse
+    url = urlparse.urlsplit(solr_url)
+    query = sorted((k, v) for (k, v) in \
+                       urlparse.parse_qsl(url.query, keep_blank_values=True) \
+                       if k != 'indent')
+    return urlparse.urlunsplit((url.scheme.lower(), url.netloc.lower(), \
+                                    url.path.rstrip('/'), \
+                                    urllib.urlencode(query), ''))
+
+def isFresh(filename, ttl):
+    """Check whether file exists and was modified less than ttl seconds ago."""
+    import os, time
+    try:
+        return time.time() - os.stat(filename).st_mtime < ttl
+    except OSError:
+        return False
+
+def writeSnapshot(snapshot_file, solr_data):
+    """Write Solr query results as fixed-width records sorted by bib id.
+
+    Header line gives id width and record count. Each record is the bib id 
+    padded with spaces, the 10-character date and a newline. The file is 
+    replaced atomically so open snapshots remain valid.
+    """
+    import os
+    width = max([len(bib) for bib in solr_data] or [1])
+    tmp_file = '%s.%d.tmp' % (snapshot_file, os.getpid())
+    with open(tmp_file, 'wb') as fh:
+        fh.write(('SOLRSNAP %d %d' % (width, len(solr_data))).ljust(63) + '\n')
+        for bib in sorted(solr_data):
+            fh.write(bib.ljust(width) + solr_data[bib][:10].ljust(10) + '\n')
+    os.rename(tmp_file, snapshot_file)
+
+class SolrSnapshot:
+    """Read-only mapping {bib: date} over a memory-mapped snapshot file.
+
+    Lookups are binary searches on the sorted records, so processes reading 
+    the same snapshot share its pages instead of each holding a dictionary.
+    """
+    header_size = 64
+
+    def __init__(self, snapshot_file):
+        import mmap
+        self.snapshot_file = snapshot_file
+        with open(snapshot_file, 'rb') as fh:
+            header = fh.read(self.header_size).split()
+            self.width = int(header[1])
+            self.count = int(header[2])
+            self.record_size = self.width + 11
+            if self.count:
+                self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.mm = ''
+
+    def find(self, bib):
+        """Return offset of record for bib, or -1 if not found."""
+        if len(bib) > self.width:
+            return -1
+        key = bib.ljust(self.width)
+        mm = self.mm
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = self.header_size + mid * self.record_size
+            found = mm[offset:offset + self.width]
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid
+            else:
+                return offset
+        return -1
+
+    def __contains__(self, bib):
+        return self.find(bib) >= 0
+
+    def __getitem__(self, bib):
+        offset = self.find(bib)
+        if offset < 0:
+            raise KeyError(bib)
+        offset += self.width
+        return self.mm[offset:offset + 10].rstrip()
+
+    def get(self, bib, default=None):
+        try:
+            return self[bib]
+        except KeyError:
+            return default
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for i in xrange(self.count):
+            offset = self.header_size + i * self.record_size
+            yield self.mm[offset:offset + self.width].rstrip()
+
+    def iteritems(self):
+        for i in xrange(self.count):
+            offset = self.header_size + i * self.record_size
+            yield self.mm[offset:offset + self.width].rstrip(), \
+                self.mm[offset + self.width:offset + self.width + 10].rstrip()
+
+def loadOutstanding(outstanding_file):
+    """Load ledger of bib ids not added or not deleted in previous audits.
+
+    Return dictionary {(bib, action): {'audit_date', 'first_seen', 'checks', 
+    'last_checked'}}, where action is 'add' or 'delete' and checks counts 
+    days on which the bib was rechecked.
+    """
+    outstanding = {}
+    try:
+        with open(outstanding_file) as fh:
+            header = fh.readline()
+            for line in fh:
+                fields = line.rstrip('\n').split('\t')
+                outstanding[(fields[0], fields[1])] = {
+                    'audit_date': fields[2],
+                    'first_seen': fields[3],
+                    'checks': int(fields[4]),
+                    # Ledgers written before last_checked was added
+                    'last_checked': fields[5] if len(fields) > 5 else ''}
+    except IOError:
+        pass
+    return outstanding
+
+def saveOutstanding(outstanding_file, outstanding):
+    """Write ledger of outstanding bib ids, replacing previous version."""
+    import os
+    header = ['bib_id', 'action', 'audit_date', 'first_seen', 'checks', 
+              'last_checked']
+    with open(outstanding_file + '.tmp', 'w') as fh:
+        fh.write('\t'.join(header) + '\n')
+        for (bib, action), entry in sorted(outstanding.iteritems()):
+            fh.write('\t'.join([bib, action, entry['audit_date'], \
+                                    entry['first_seen'], \
+                                    str(entry['checks']), \
+                                    entry['last_checked']]) + '\n')
+    os.rename(outstanding_file + '.tmp', outstanding_file)
+
+def recheckOutstanding(outstanding, solr_url, timeout=300, max_age=None):
+    """Recheck outstanding bib ids against Solr with targeted queries.
+
+    Bibs to add are resolved once timestamped on or after the audit date of 
+    the error; bibs to delete are resolved once absent. Each bib is rechecked 
+    at most once a day. Resolved bibs, and bibs whose error is older than 
+    max_age days, are removed from the ledger. Return dictionary 
+    {action: {'checked', 'resolved', 'expired', 'remaining', 'oldest'}}.
+    """
+    from datetime import date, datetime
+    counts = dict((action, {'checked': 0, 'resolved': 0, 'expired': 0, \
+                                'remaining': 0, 'oldest': None}) \
+                      for action in ['add', 'delete'])
+    today_string = getDateString(None)
+    due = sorted(key for (key, entry) in outstanding.iteritems() \
+                     if entry['last_checked'] != today_string)
+    if not due:
+        return counts
+    solr_data = querySolrIds(solr_url, set(bib for (bib, action) in due), \
+                                 timeout)
+    today = date.today()
+    for key in due:
+        bib, action = key
+        entry = outstanding[key]
+        entry['checks'] += 1
+        entry['last_checked'] = today_string
+        counts[action]['checked'] += 1
+        resolved = isSolrUpdated(action, solr_data.get(bib), \
+                                     entry['audit_date'])
+        age = (today - datetime.strptime(entry['audit_date'], \
+                                             '%Y-%m-%d').date()).days
+        if resolved:
+            counts[action]['resolved'] += 1
+            del outstanding[key]
+        elif max_age is not None and age > max_age:
+            counts[action]['expired'] += 1
+            del outstanding[key]
+        else:
+            counts[action]['remaining'] += 1
+            if counts[action]['oldest'] is None or \
+                    entry['audit_date'] < counts[action]['oldest']:
+                counts[action]['oldest'] = entry['audit_date']
+    return counts
+
+def updateOutstanding(outstanding, solr_results, audit_date):
+    """Add bibs not added or not deleted in current audit to ledger, and 
+    remove bibs added or deleted successfully. New bibs are first rechecked 
+    the next day."""
+    today = getDateString(None)
+    results = [('add', 'solr_added', 'solr_not_added'), 
+               ('delete', 'solr_deleted', 'solr_not_deleted')]
+    for action, success_key, error_key in results:
+        for bib in solr_results[success_key]:
+            outstanding.pop((bib, action), None)
+        for bib in solr_results[error_key]:
+            entry = outstanding.setdefault((bib, action), \
+                                               {'first_seen': today, \
+                                                    'checks': 0, \
+                                                    'last_checked': today})
+            entry['audit_date'] = audit_date
+
+def formatOutstanding(timestamp, audit_date, source_name, counts):
+    """Format stat rows and email notes for recheck of outstanding bibs.
+
+    Stat columns are bibs rechecked, resolved, and still outstanding.
+    """
+    stat_rows = []
+    notes = []
+    for action, label in [('add', 'ADD OUTSTANDING'), \
+                              ('delete', 'DEL OUTSTANDING')]:
+        c = counts[action]
+        if not c['checked']:
+            continue
+        stat_rows.append([timestamp, audit_date, source_name, label, \
+                              str(c['checked']), str(c['resolved']), \
+                              str(c['remaining'])])
+        note = '%s: %d rechecked, %d resolved, %d outstanding' \
+            % (label, c['checked'], c['resolved'], c['remaining'])
+        if c['oldest']:
+            note += ' (oldest from %s)' % c['oldest']
+        if c['expired']:
+            note += ', %d expired' % c['expired']
+        notes.append(note)
+    return stat_rows, notes
+
+def getCheckpointFile(checkpoint_path, source_name, audit_date):
+    """Construct checkpoint filename for source, audit date, time of run and 
+    process id."""
+    import os
+    from datetime import datetime
+    return '%s%s.%s.%s.%d.ckpt' % (checkpoint_path, source_name, \
+                                       audit_date.replace('-', ''), \
+                                       datetime.now().strftime('%H%M%S'), \
+                                       os.getpid())
+
+def findCheckpoints(checkpoint_path, source_name, audit_date):
+    """Find checkpoints of incomplete audits for source and audit date. 
+    Return list of filenames, oldest first."""
+    import glob, os
+    # Order by time of run in filename, then by last stage saved
+    return sorted(glob.glob(checkpoint_path + source_name + '.' + \
+                                audit_date.replace('-', '') + '.*.ckpt'), \
+                      key=lambda f: (f.rsplit('.', 3)[1], \
+                                         os.path.getmtime(f)))
+
+def findCheckpoint(checkpoint_path, source_name, audit_date):
+    """Find checkpoint of most recent incomplete audit for source and audit 
+    date. Return filename, or None if not found."""
+    found = findCheckpoints(checkpoint_path, source_name, audit_date)
+    if found:
+        return found[-1]
+    return None
+
+def getCheckpointStages(checkpoint_file):
+    """Get list of stages completed by an incomplete audit, without loading 
+    values saved by the stages."""
+    import cPickle
+    try:
+        with open(checkpoint_file, 'rb') as fh:
+            return cPickle.load(fh)['stages']
+    except IOError:
+        return []
+
+def loadCheckpoint(checkpoint_file):
+    """Load checkpoint of an incomplete audit, with values saved by each 
+    completed stage.
+
+    Return dictionary of values saved by completed stages, with stage names 
+    listed in order under 'stages'; no stages if checkpoint does not exist.
+    """
+    import cPickle, os
+    try:
+        with open(checkpoint_file, 'rb') as fh:
+            checkpoint = cPickle.load(fh)
+    except IOError:
+        return {'stages': []}
+    for stage in checkpoint['stages']:
+        stage_file = checkpoint_file + '.' + stage
+        if os.path.exists(stage_file):
+            with open(stage_file, 'rb') as fh:
+                checkpoint.update(cPickle.load(fh))
+    return checkpoint
+
+def saveCheckpoint(checkpoint_file, checkpoint, stage, **values):
+    """Record stage as complete in checkpoint, with values needed to resume 
+    later stages.
+
+    Values are written once to a file for the stage, so large values from 
+    earlier stages are not rewritten; the checkpoint file itself lists 
+    completed stages only.
+    """
+    import cPickle, os
+    checkpoint.update(values)
+    checkpoint['stages'].append(stage)
+    if values:
+        stage_file = checkpoint_file + '.' + stage
+        with open(stage_file + '.tmp', 'wb') as fh:
+            cPickle.dump(values, fh, cPickle.HIGHEST_PROTOCOL)
+        os.rename(stage_file + '.tmp', stage_file)
+    with open(checkpoint_file + '.tmp', 'wb') as fh:
+        cPickle.dump({'stages': checkpoint['stages']}, fh, \
+                         cPickle.HIGHEST_PROTOCOL)
+    os.rename(checkpoint_file + '.tmp', checkpoint_file)
+
+def clearCheckpoint(checkpoint_file):
+    """Remove checkpoint, stage values and linked Solr snapshot once audit is 
+    complete."""
+    import glob, os
+    for f in [checkpoint_file] + glob.glob(checkpoint_file + '.*'):
+        if os.path.exists(f):
+            os.remove(f)
+
+def linkSnapshot(solr_data, checkpoint_file):
+    """Hard link Solr snapshot to checkpoint, so the dataset used by the audit
+    is kept if the snapshot cache is refreshed.
+
+    Return path of linked snapshot, or None if solr_data is not a snapshot.
+    """
+    import os, shutil
+    if not isinstance(solr_data, SolrSnapshot):
+        return None
+    snapshot_file = checkpoint_file + '.snap'
+    if os.path.exists(snapshot_file):
+        os.remove(snapshot_file)
+    try:
+        os.link(solr_data.snapshot_file, snapshot_file)
+    except OSError:
+        shutil.copyfile(solr_data.snapshot_file, snapshot_file)
+    return snapshot_file
+
 def appendOutput(data, path, filename):
     """Append output to file."""
     with open(path + filename, 'a+') as fh:
@@ -88,34 +974,55 @@ def getBibsFromMarc(path, marc_file_list, mfhd=False):
     Skip MFHDs if mfhd=True. Return values as dictionary of sets 
     {filename: set(bibs)}.
     """
-    from pymarc import MARCReader, Record, Field
     bib_set_dict = dict()
     for f in marc_file_list:
-        bib_set_dict[f] = set()
-        reader = MARCReader(file(path + f), to_unicode=True)
-        for record in reader:
-            if mfhd and not record.get_fields('004'):
-                bib_set_dict[f].add(record['001'].value())
-            elif not mfhd:
-                bib_set_dict[f].add(record['001'].value())
+        bib_set_dict[f] = set(iterBibsFromMarc(path, f, mfhd))
     return bib_set_dict
 
+def iterBibsFromMarc(path, marc_file, mfhd=False):
+    """Generate bib ids from a .mrc file, one record at a time. 
+
+    Skip MFHDs if mfhd=True.
+    """
+    from pymarc import MARCReader, Record, Field
+    reader = MARCReader(file(path + marc_file), to_unicode=True)
+    for record in reader:
+        if mfhd and not record.get_fields('004'):
+            yield record['001'].value()
+        elif not mfhd:
+            yield record['001'].value()
+
 def getBibsFromText(path, text_file_list, bib_pattern):
     """Process text file(s) listing bib ids. 
 
     Return values as dictionary of sets {filename: set(bibs)}.
     """
-    import re
-    patt = r'{0}'.format(bib_pattern)
     bib_set_dict = dict()
     for f in text_file_list:
-        bib_set_dict[f] = set()
-        with open(path + f) as fh:
-            for line in fh:
-                if re.match(patt, line):
-                    bib_set_dict[f].add(line.rstrip('\r\n'))
+        bib_set_dict[f] = set(iterBibsFromText(path, f, bib_pattern))
     return bib_set_dict
 
+def iterBibsFromText(path, text_file, bib_pattern):
+    """Generate bib ids from a text file listing bib ids, one line at a time.
+    """
+    import re
+    patt = r'{0}'.format(bib_pattern)
+    with open(path + text_file) as fh:
+        for line in fh:
+            if re.match(patt, line):
+                yield line.rstrip('\r\n')
+
+def iterExtractBibs(path, file_dict, mfhd, bib_pattern):
+    """Generate (action, filename, bib id generator) for each extract file, 
+    in the order additions, suppressions, deletions and by filename within 
+    each action, as removeProcessedBibs dedupes them."""
+    for action in ['add', 'suppress', 'delete']:
+        for f in sorted(file_dict.get(action, [])):
+            if action == 'add':
+                yield action, f, iterBibsFromMarc(path, f, mfhd)
+            else:
+                yield action, f, iterBibsFromText(path, f, bib_pattern)
+
 def getProcessedFiles(source_log_path, source_log_file, source_alt_date, \
                           regex_dict):
     """Extract names of files already processed on current date from log.
@@ -188,18 +1095,436 @@ def combineSets(set_dict):
         new_set.update(old_set)
     return new_set
 
+def isSolrUpdated(action, solr_date, audit_date):
+    """Check whether Solr reflects action for a bib, where solr_date is its 
+    date in Solr or None if not present.
+
+    Bibs to add succeed if present and timestamped on or after audit_date; 
+    bibs to suppress or delete succeed if not present.
+    """
+    if action == 'add':
+        return solr_date is not None and solr_date >= audit_date
+    return solr_date is None
+
+def compareToSolr(source_bibs, solr_data, audit_date):
+    """Check bibs from extracts against Solr data with isSolrUpdated.
+
+    Return dictionaries of successful and unsuccessful bibs by action.
+    """
+    solr_success = dict((k, set()) for k in source_bibs.iterkeys())
+    solr_error = dict((k, set()) for k in source_bibs.iterkeys())
+    for action, bibs in source_bibs.iteritems():
+        for bib in bibs:
+            success = isSolrUpdated(action, solr_data.get(bib), audit_date)
+            if success:
+                solr_success[action].add(bib)
+            else:
+                solr_error[action].add(bib)
+    return solr_success, solr_error
+
+def sampleBibs(bibs_by_file, sample_size, seed):
+    """Draw a reproducible random sample of up to sample_size bib ids from each
+    extract file, seeded by seed and filename.
+
+    Return dictionary {action: set(bibs)}.
+    """
+    import hashlib, random
+    sample = {}
+    for action, file_sets in bibs_by_file.iteritems():
+        sample[action] = set()
+        for f, bib_set in file_sets.iteritems():
+            # Integer seed, as string seeds depend on hash() of the platform
+            rng = random.Random(int(hashlib.sha1('%s %s' % (seed, f)) \
+                                        .hexdigest(), 16))
+            bibs = sorted(bib_set)
+            sample[action].update(rng.sample(bibs, min(sample_size, \
+                                                           len(bibs))))
+    return sample
+
+def estimateRate(successes, n, z=1.96):
+    """Estimate success rate from a sample, with Wilson score confidence 
+    interval (95% for default z).
+
+    Return rate, lower bound, upper bound.
+    """
+    import math
+    if n == 0:
+        return 1.0, 0.0, 1.0
+    p = float(successes) / n
+    denominator = 1 + z * z / n
+    centre = (p + z * z / (2 * n)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / \
+        denominator
+    return p, max(0.0, centre - half_width), min(1.0, centre + half_width)
+
+def sampleAudit(bibs_by_file, solr_url, audit_date, seed, sample_size, \
+                    max_error_rate, timeout=300):
+    """Audit a random sample of each extract file with targeted Solr queries 
+    and estimate success rates for additions and deletions.
+
+    escalate is True if the upper confidence bound of an error rate exceeds 
+    max_error_rate. Return dictionary with Solr data for sampled bibs ('data'),
+    results by action ('success', 'error'), estimates by stat action ('ADD', 
+    'DEL') and 'escalate'.
+    """
+    sample = sampleBibs(bibs_by_file, sample_size, seed)
+    solr_data = querySolrIds(solr_url, combineSets(sample), timeout)
+    solr_success, solr_error = compareToSolr(sample, solr_data, audit_date)
+    estimates = {}
+    escalate = False
+    for label, actions in [('ADD', ['add']), ('DEL', ['suppress', 'delete'])]:
+        extract = set()
+        for action in actions:
+            for bib_set in bibs_by_file[action].itervalues():
+                extract.update(bib_set)
+        sampled = set().union(*[sample[a] for a in actions])
+        errors = set().union(*[solr_error[a] for a in actions])
+        rate, lower, upper = estimateRate(len(sampled) - len(errors), \
+                                              len(sampled))
+        estimates[label] = {'extract': len(extract), 'sampled': len(sampled), 
+                            'errors': len(errors), 'rate': rate, 
+                            'lower': lower, 'upper': upper}
+        if sampled and 1 - lower > max_error_rate:
+            escalate = True
+    return {'data': solr_data, 'success': solr_success, 'error': solr_error, 
+            'estimates': estimates, 'escalate': escalate}
+
+def formatSample(timestamp, audit_date, source_name, sample):
+    """Format stat rows and email notes for sampling audit.
+
+    Stat columns are bibs in extract and estimated load and errors.
+    """
+    stat_rows = []
+    notes = []
+    for label in ['ADD', 'DEL']:
+        e = sample['estimates'][label]
+        load = int(round(e['rate'] * e['extract']))
+        stat_rows.append([timestamp, audit_date, source_name, \
+                              label + ' SAMPLED', str(e['extract']), \
+                              str(load), str(e['extract'] - load)])
+        notes.append('%s SAMPLED: %d of %d verified, %d errors; estimated ' \
+                         'success rate %.2f%% (95%% CI %.2f%%-%.2f%%)' \
+                         % (label, e['sampled'], e['extract'], e['errors'], \
+                                100 * e['rate'], 100 * e['lower'], \
+                                100 * e['upper']))
+    if sample['escalate']:
+        notes.append('Estimated error rate above threshold; full audit run.')
+    return stat_rows, notes
+
+def scaleSampleStats(file_stats):
+    """Scale per-file load and error counts from attributeResults for a 
+    sample up to the number of bibs in each extract file."""
+    for actions in file_stats.itervalues():
+        for counts in actions.itervalues():
+            sampled = counts['load'] + counts['error']
+            if sampled:
+                counts['error'] = int(round(float(counts['error']) * \
+                                                counts['extract'] / sampled))
+                counts['load'] = counts['extract'] - counts['error']
+
+def indexBibsByFile(bibs_by_file):
+    """Map each bib id to the extract file containing it, by action.
+
+    Bib ids are unique across files for an action once removeProcessedBibs has 
+    run. Return dictionary {action: {bib: filename}}.
+    """
+    bib_index = {}
+    for action, file_sets in bibs_by_file.iteritems():
+        bib_index[action] = {}
+        for f, bib_set in file_sets.iteritems():
+            bib_index[action].update(dict.fromkeys(bib_set, f))
+    return bib_index
+
+def attributeResults(bib_index, solr_success, solr_error, file_dict):
+    """Count extract, load and error bibs for each extract file in a single 
+    pass over the bib index.
+
+    Every file in file_dict {action: [filenames]} is included, with zero counts
+    if no bibs remain. Return dictionary {filename: {action: {'extract': n, 
+    'load': n, 'error': n}}}.
+    """
+    file_stats = {}
+    for action, filenames in file_dict.iteritems():
+        for f in filenames:
+            file_stats.setdefault(f, {})[action] = \
+                {'extract': 0, 'load': 0, 'error': 0}
+    for action, bib_files in bib_index.iteritems():
+        success = solr_success[action]
+        error = solr_error[action]
+        for bib, f in bib_files.iteritems():
+            counts = file_stats[f][action]
+            counts['extract'] += 1
+            if bib in success:
+                counts['load'] += 1
+            elif bib in error:
+                counts['error'] += 1
+    return file_stats
+
+# Action and outcome recorded in bib history for each data file key
+HISTORY_KEYS = {
+    'solr_added': ('add', 'success'),
+    'solr_deleted': ('delete', 'success'),
+    'solr_not_added': ('add', 'error'),
+    'solr_not_deleted': ('delete', 'error')}
+
 def writeBibsToLogs(solr_data, solr_results, data_path, data_files, \
-                        data_headers):
+                        data_headers, **kwargs):
     """Generate files listing bib ids associated with a particular action and 
-    status, and timestamp if applicable."""
+    status, and timestamp if applicable.
+
+    If bib_files is given as {key: [{bib: filename}, ...]}, the extract file 
+    for each bib is added as a final column. If history_file is given, each
+    bib is also added to the bib history store for source_name and 
+    audit_date. For successful bibs, dates in verified {action: {bib: date}} 
+    from verifyErrors are used instead of solr_data.
+    """
+    bib_files = kwargs.get('bib_files', None)
+    verified = kwargs.get('verified', {})
+    history_file = kwargs.get('history_file', None)
+    source_name = kwargs.get('source_name', None)
+    audit_date = kwargs.get('audit_date', None)
+    # Dates from verifyErrors for each successful data file key
+    verified_dates = {
+        'solr_added': verified.get('add', {}),
+        'solr_deleted': dict(verified.get('suppress', {}), \
+                                 **verified.get('delete', {}))}
+    if history_file is not None:
+        db = openHistory(history_file)
     for key, filename in data_files.iteritems():
+        history_rows = []
+        dates = verified_dates.get(key, {})
         with open(data_path + filename[0], 'w') as fh:
             fh.write('\t'.join(data_headers[key]) + '\n')
             for bib in solr_results[key]:
                 try:
-                    fh.write(bib + '\t' + solr_data[bib] + '\n')
+                    solr_date = dates[bib] if bib in dates \
+                        else solr_data[bib]
                 except KeyError:
-                    fh.write(bib + '\t\n')
+                    solr_date = ''
+                line = bib + '\t' + solr_date
+                if bib_files:
+                    f = ''
+                    for index in bib_files[key]:
+                        if bib in index:
+                            f = index[bib]
+                            break
+                    line += '\t' + f
+                fh.write(line + '\n')
+                if history_file is not None:
+                    history_rows.append((bib, source_name, audit_date) + \
+                                            HISTORY_KEYS[key] + (solr_date,))
+                    if len(history_rows) >= 10000:
+                        db.executemany('INSERT INTO history VALUES ' \
+                                           '(?, ?, ?, ?, ?, ?)', history_rows)
+                        history_rows = []
+        if history_file is not None:
+            db.executemany('INSERT INTO history VALUES (?, ?, ?, ?, ?, ?)', \
+                               history_rows)
+    if history_file is not None:
+        db.commit()
+        db.close()
+
+def streamComparison(bib_streams, solr_data, audit_date, data_path, \
+                         data_files, data_headers, **kwargs):
+    """Check bibs from extract files against Solr data as each file is read, 
+    writing each successful bib to its data file as it is classified.
+
+    bib_streams is a sequence of (action, filename, bibs) as generated by 
+    iterExtractBibs. Bibs in processed_bibs {action: set(bibs)} or in an 
+    earlier file for the same action are skipped, and suppressed bibs are not 
+    repeated for deletion. Only ids seen so far and unsuccessful bibs are kept 
+    in memory, with successful bibs in watch (outstanding from earlier audits).
+    Unsuccessful bibs are written once all files are read, after checking 
+    them with verifyErrors if verify_url is given (with timeout, verify_wait 
+    and verify_interval). Data files {key: (filename, attach)} are created 
+    when the first bib for them is found; by_file and history_file work as 
+    for writeBibsToLogs.
+
+    Return dictionary with data files written ('data_files'), bib counts by 
+    data file key ('counts') and stat action ('extract'), per-file stats as 
+    for attributeResults ('file_stats'), bib sets by data file key 
+    ('results') and bibs confirmed by verifyErrors ('verified').
+    """
+    processed_bibs = kwargs.get('processed_bibs', {})
+    watch = kwargs.get('watch', set())
+    by_file = kwargs.get('by_file', False)
+    history_file = kwargs.get('history_file', None)
+    source_name = kwargs.get('source_name', None)
+    verify_url = kwargs.get('verify_url', None)
+    # Data file key for bibs confirmed by verifyErrors
+    verified_keys = {
+        'solr_not_added': 'solr_added',
+        'solr_not_deleted': 'solr_deleted'}
+    handles = {}
+    counts = dict((k, 0) for k in HISTORY_KEYS.iterkeys())
+    results = dict((k, set()) for k in HISTORY_KEYS.iterkeys())
+    file_stats = {}
+    seen = {}
+    deleted = set()
+    # Unsuccessful bibs by action, with data file rows and per-file stats
+    errors = {}
+    error_rows = []
+    error_stats = {}
+    history_rows = []
+    if history_file is not None:
+        db = openHistory(history_file)
+    try:
+        for action, f, bibs in bib_streams:
+            stats = file_stats.setdefault(f, {})[action] = \
+                {'extract': 0, 'load': 0, 'error': 0}
+            done = seen.setdefault(action, set())
+            skip = processed_bibs.get(action, ())
+            for bib in bibs:
+                if bib in done or bib in skip:
+                    continue
+                done.add(bib)
+                stats['extract'] += 1
+                solr_date = solr_data.get(bib)
+                success = isSolrUpdated(action, solr_date, audit_date)
+                if action == 'add':
+                    key = 'solr_added' if success else 'solr_not_added'
+                else:
+                    key = 'solr_deleted' if success else 'solr_not_deleted'
+                solr_date = solr_date or ''
+                if success:
+                    stats['load'] += 1
+                else:
+                    stats['error'] += 1
+                    errors.setdefault(action, set()).add(bib)
+                    error_stats.setdefault((action, bib), []).append(stats)
+                # Bibs both suppressed and deleted are written once
+                if action != 'add':
+                    if bib in deleted:
+                        continue
+                    deleted.add(bib)
+                if not success:
+                    error_rows.append((key, action, bib, solr_date, f))
+                    continue
+                counts[key] += 1
+                if bib in watch:
+                    results[key].add(bib)
+                writeDataRow(handles, data_path, data_files, data_headers, \
+                                 key, [bib, solr_date, f], by_file)
+                if history_file is not None:
+                    history_rows.append((bib, source_name, audit_date) + \
+                                            HISTORY_KEYS[key] + (solr_date,))
+                    if len(history_rows) >= 10000:
+                        db.executemany('INSERT INTO history VALUES ' \
+                                           '(?, ?, ?, ?, ?, ?)', history_rows)
+                        history_rows = []
+        # Confirm errors that may be due to updates not yet committed
+        if verify_url is not None and error_rows:
+            verified = verifyErrors(verify_url, errors, audit_date, \
+                                        kwargs.get('timeout', 300), \
+                                        kwargs.get('verify_wait', 60), \
+                                        kwargs.get('verify_interval', 10))
+        else:
+            verified = {}
+        for key, action, bib, solr_date, f in error_rows:
+            # Suppressed and deleted bibs written once are verified for both
+            if action == 'add':
+                actions = ['add']
+            else:
+                actions = ['suppress', 'delete']
+            if bib in verified.get(action, {}):
+                for a in actions:
+                    if bib in verified.get(a, {}):
+                        for stats in error_stats.get((a, bib), []):
+                            stats['error'] -= 1
+                            stats['load'] += 1
+                key = verified_keys[key]
+                solr_date = verified[action][bib]
+                if bib in watch:
+                    results[key].add(bib)
+            else:
+                results[key].add(bib)
+            counts[key] += 1
+            writeDataRow(handles, data_path, data_files, data_headers, key, \
+                             [bib, solr_date, f], by_file)
+            if history_file is not None:
+                history_rows.append((bib, source_name, audit_date) + \
+                                        HISTORY_KEYS[key] + (solr_date,))
+        if history_file is not None:
+            db.executemany('INSERT INTO history VALUES (?, ?, ?, ?, ?, ?)', \
+                               history_rows)
+            db.commit()
+    finally:
+        for fh in handles.itervalues():
+            fh.close()
+        if history_file is not None:
+            db.close()
+    add = seen.get('add', set())
+    return {'data_files': dict((k, data_files[k]) for k in handles), 
+            'counts': counts, 
+            'extract': {'add': len(add), 'del': len(deleted)}, 
+            'file_stats': file_stats, 'results': results, 
+            'verified': verified}
+
+def writeDataRow(handles, data_path, data_files, data_headers, key, row, \
+                     by_file=False):
+    """Write row [bib, date, extract file] to data file for key, creating 
+    the file with its header if not yet open in handles {key: file}. The 
+    extract file is omitted unless by_file is set."""
+    if key not in handles:
+        handles[key] = open(data_path + data_files[key][0], 'w')
+        handles[key].write('\t'.join(data_headers[key]) + '\n')
+    if not by_file:
+        row = row[:2]
+    handles[key].write('\t'.join(row) + '\n')
+
+def openHistory(history_file):
+    """Open bib history store, creating table and bib id index if needed.
+
+    The store is append-only apart from compactHistory. Return sqlite3 
+    connection.
+    """
+    import sqlite3
+    db = sqlite3.connect(history_file, timeout=60)
+    db.execute('CREATE TABLE IF NOT EXISTS history (bib_id TEXT, source TEXT, '
+               'audit_date TEXT, action TEXT, outcome TEXT, '
+               'solr_timestamp TEXT)')
+    db.execute('CREATE INDEX IF NOT EXISTS history_bib ON history (bib_id)')
+    return db
+
+def queryHistory(history_file, source_name, bibs):
+    """Look up audit history of bib ids for source.
+
+    Return list of rows [bib_id, audit_date, action, outcome, solr_timestamp]
+    ordered by bib id and audit date.
+    """
+    db = openHistory(history_file)
+    rows = []
+    for bib in bibs:
+        rows.extend(db.execute('SELECT bib_id, audit_date, action, outcome, '
+                               'solr_timestamp FROM history WHERE bib_id = ? '
+                               'AND source = ? ORDER BY audit_date, rowid', \
+                                   (bib, source_name)))
+    db.close()
+    return [[str(field) for field in row] for row in rows]
+
+def compactHistory(history_file, source_name, keep_days):
+    """Remove history rows for source with audit dates more than keep_days 
+    ago, except the most recent row for each bib id and action, and reclaim 
+    space. Return number of rows removed."""
+    from datetime import date, timedelta
+    cutoff = str(date.today() - timedelta(keep_days))
+    db = openHistory(history_file)
+    removed = db.execute('DELETE FROM history WHERE source = ? AND '
+                         'audit_date < ? AND rowid NOT IN (SELECT MAX(rowid) '
+                         'FROM history WHERE source = ? GROUP BY bib_id, '
+                         'action)', (source_name, cutoff, source_name)).rowcount
+    db.commit()
+    db.execute('VACUUM')
+    db.close()
+    return removed
+
+def getBibList(bibs):
+    """Get bib ids from command line argument: comma-separated ids, or 
+    @filename for a file listing one id per line."""
+    if bibs.startswith('@'):
+        with open(bibs[1:]) as fh:
+            return [line.strip() for line in fh if line.strip()]
+    return [bib.strip() for bib in bibs.split(',') if bib.strip()]
 
 def getColumnWidths(data, padding=3):
     """Get column widths for writing tabular data to output.
@@ -238,17 +1563,21 @@ def formatReport(audit_date, source_name, status, cwd, **kwargs):
     # Define keyword arguments
     log = kwargs.get('log', None)
     stats = kwargs.get('stats', None)
+    notes = kwargs.get('notes', None)
     # log data
     log_data_output = formatTabularData(log, padding=5)
+    sections = [source_heading, log_data_output]
     # stats data
     try:
         stats_data_output = formatTabularData(stats)
-        report = '\n'.join([source_heading, log_data_output, '', \
-                                stats_data_output, '\n', footer])
-        return subject, report
+        sections.extend(['', stats_data_output])
     except (ValueError, TypeError):
-        report = '\n'.join([source_heading, log_data_output, '\n', footer])
-        return subject, report
+        pass
+    # notes
+    if notes:
+        sections.extend([''] + notes)
+    report = '\n'.join(sections + ['\n', footer])
+    return subject, report
 
 def writeEmail(server, sender, recipients, subject, report, **kwargs):
     """Construct and send notification email with data file attachments, if any.
@@ -310,6 +1639,7 @@ def writeEmailToFile(email_path, email_filename, extension, msg):
     filename = getFileNameTimestamp(email_filename, extension)
     with open(email_path + filename, 'w') as fh:
         fh.write(msg.as_string())
+    return filename
 
 def getFileNameTimestamp(filename_base, file_extension):
     """Construct filename using text base set in params and timestamp."""
@@ -330,8 +1660,12 @@ def getPaths(source_log_path, source_stat_path, source_data_path, \
 
 def doFileRotation(source_rotation_data, path_dict, source_archive_path, \
                        source_email_server, source_email_sender, \
-                       source_email_recipients):
-    """Archive and delete files according to settings in params.py"""
+                       source_email_recipients, catalog_file=None):
+    """Archive and delete files according to settings in params.py
+
+    Catalog entries for files moved or deleted are updated if catalog_file is 
+    set.
+    """
     import os
     for action in source_rotation_data:
         for file_ext in source_rotation_data[action]:
@@ -360,8 +1694,13 @@ def doFileRotation(source_rotation_data, path_dict, source_archive_path, \
                     if action == 'archive':
                         os.rename(path_dict[file_ext] + f, \
                                       source_archive_path + f)
+                        if catalog_file is not None:
+                            moveCatalogArtifact(catalog_file, f, \
+                                                    source_archive_path)
                     elif action == 'delete':
                         os.remove(path_dict[file_ext] + f)
+                        if catalog_file is not None:
+                            moveCatalogArtifact(catalog_file, f, None)
 
 def sendRotationOutput(action, action_file, server, sender, recipients):
     """Send email notification when rotation action taken."""
@@ -406,13 +1745,21 @@ def processArgs(args):
     """Process command line options."""
     import getopt, sys
     try:
-        optlist, args = getopt.getopt(args, 'd:r:s:v:', ['date=', 'resend=',
-                                                         'source=', 'viz='])
+        optlist, args = getopt.getopt(args, 'd:r:s:v:o:c:b:k', ['date=', 
+                                                               'resend=',
+                                                               'source=', 
+                                                               'viz=',
+                                                               'outputs=',
+                                                               'resume=',
+                                                               'bib=',
+                                                               'compact'])
     except getopt.GetoptError as err:
         print err
         usage()
         sys.exit()
-    arg_dict = {'date': None, 'resend': None, 'source': None, 'viz': None}
+    arg_dict = {'date': None, 'resend': None, 'source': None, 'viz': None,
+                'outputs': None, 'resume': None, 'bib': None, 
+                'compact': False}
     for o, a in optlist:
         if o in ('-d', '--date'):
             arg_dict['date'] = a
@@ -422,16 +1769,30 @@ def processArgs(args):
             arg_dict['source'] = a
         if o in ('-v', '--viz'):
             arg_dict['viz'] = a
+        if o in ('-o', '--outputs'):
+            arg_dict['outputs'] = a
+        if o in ('-c', '--resume'):
+            arg_dict['resume'] = a
+        if o in ('-b', '--bib'):
+            arg_dict['bib'] = a
+        if o in ('-k', '--compact'):
+            arg_dict['compact'] = True
     return arg_dict
 
 def usage():
     """Info message about command-line options."""
     print 'Options: use -d or --date=YYYYMMDD to set alternate audit date; ' + \
-        'use -r or --resend=YYYYMMDD to resend email notifications from ' + \
-        'indicated date; use -s or --source=source1 or source2 to limit ' + \
+        'use -r or --resend=YYYYMMDD or YYYYMMDD-YYYYMMDD to resend email ' + \
+        'notifications from indicated date(s); use -o or ' + \
+        '--outputs=YYYYMMDD or YYYYMMDD-YYYYMMDD to list output files from ' + \
+        'indicated date(s); use -s or --source=source1 or source2 to limit ' + \
         'audit or optional action to one datasource; use -v or -viz=off or ' + \
-        'on to toggle output to data visualization service. All options ' + \
-        'may be combined, except -r with -d or -v.'
+        'on to toggle output to data visualization service; use -c or ' + \
+        '--resume=YYYYMMDD to resume an incomplete audit for the indicated ' + \
+        'audit date from its last completed stage; use -b or ' + \
+        '--bib=id1,id2 or @filename to show audit history of bib ids; use ' + \
+        '-k or --compact to remove old bib history. All options may be ' + \
+        'combined, except -r, -o, -b or -k with -d, -v or -c, and -c with -d.'
 
 def setDate(date):
     """Format date from command line argument."""
@@ -442,14 +1803,27 @@ def setDate(date):
     alternate_date = date[:4] + '-' + date[4:6] + '-' + date[6:]
     return alternate_date
 
-def resendEmail(source_name, filebase, server, date, email_path, archive_path):
-    """Resend email notifications for date from command line argument."""
-    import smtplib, email, sys
-    path_list = [email_path, archive_path]
-    email_files = matchFile(filebase, 'email', path_list, date)
-    if not email_files:
-        print 'No emails found from %s for %s.' % (source_name, date)
-        return 0
+def getDateRange(dates):
+    """Expand date or date range from command line argument.
+
+    Return list of dates in form YYYYMMDD.
+    """
+    import sys
+    from datetime import datetime, timedelta
+    try:
+        ends = [datetime.strptime(d, '%Y%m%d') for d in dates.split('-')]
+    except ValueError:
+        ends = []
+    if len(ends) not in (1, 2) or ends[0] > ends[-1]:
+        print 'Please enter date in form YYYYMMDD or YYYYMMDD-YYYYMMDD.'
+        sys.exit()
+    days = (ends[-1] - ends[0]).days
+    return [(ends[0] + timedelta(n)).strftime('%Y%m%d') \
+                for n in range(days + 1)]
+
+def resendEmail(server, email_files):
+    """Resend email notification files over a single SMTP session."""
+    import smtplib, email
     smtp = smtplib.SMTP(server)
     for f in email_files:
         msg = email.message_from_file(file(f))
@@ -457,23 +1831,137 @@ def resendEmail(source_name, filebase, server, date, email_path, archive_path):
         recipients = msg['to']
         smtp.sendmail(sender, recipients, msg.as_string())
     smtp.close()
-    return 1
 
-def matchFile(filebase, extension, path_list, date):
-    """Identify matching files in designated paths from filename base, 
-    extension, and audit date."""
-    import os
-    match_files = []
-    for path in path_list:
+@contextmanager
+def lockedFile(lock_file):
+    """Hold an exclusive lock on lock_file, shared between processes, for the 
+    duration of a with block."""
+    import fcntl
+    with open(lock_file, 'a') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
         try:
-            for f in os.listdir(path):
-                parts = f.split('.')
-                if parts[0] == filebase and parts[1] == date and \
-                        parts[-1] == extension:
-                    match_files.append(path + f)
-        except OSError:
-            pass
-    return match_files
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+def loadCatalog(catalog_file):
+    """Load catalog of audit artifacts.
+
+    Return dictionary {filename: {'source', 'kind', 'date', 'audit_date', 
+    'path'}}, empty if catalog does not exist.
+    """
+    import json
+    try:
+        with open(catalog_file) as fh:
+            return json.load(fh)
+    except IOError:
+        return {}
+
+def saveCatalog(catalog_file, catalog):
+    """Write catalog of audit artifacts, replacing previous version."""
+    import json, os
+    with open(catalog_file + '.tmp', 'w') as fh:
+        json.dump(catalog, fh, indent=1, sort_keys=True)
+    os.rename(catalog_file + '.tmp', catalog_file)
+
+def parseArtifactName(filename):
+    """Get date written and audit date (YYYYMMDD) from artifact filename.
+
+    Audit date differs from date written only if an alternate date was set.
+    """
+    import re
+    date = re.findall(r'\.(\d{8})\.\d{6}\.', filename)[-1]
+    alt = re.findall(r'\.(\d{8})ALT\.', filename)
+    if alt:
+        return date, alt[-1]
+    return date, date
+
+def catalogArtifacts(catalog_file, source_name, kind, path, filenames):
+    """Add audit artifacts written to path to catalog.
+
+    kind is the file extension used for rotation ('email', 'bib.txt', 
+    'viz.sql').
+    """
+    with lockedFile(catalog_file + '.lock'):
+        catalog = loadCatalog(catalog_file)
+        for f in filenames:
+            date, audit_date = parseArtifactName(f)
+            catalog[f] = {'source': source_name, 'kind': kind, 'date': date, 
+                          'audit_date': audit_date, 'path': path}
+        saveCatalog(catalog_file, catalog)
+
+def moveCatalogArtifact(catalog_file, filename, path):
+    """Update location of cataloged artifact, or remove it if path is None.
+
+    Files not in catalog are ignored.
+    """
+    with lockedFile(catalog_file + '.lock'):
+        catalog = loadCatalog(catalog_file)
+        if filename not in catalog:
+            return
+        if path is None:
+            del catalog[filename]
+        else:
+            catalog[filename]['path'] = path
+        saveCatalog(catalog_file, catalog)
+
+def findArtifacts(catalog, source_name, dates, kind=None):
+    """Look up artifacts for source written on dates (YYYYMMDD), optionally 
+    limited to one kind.
+
+    Return list of (filename, entry) sorted by date and filename.
+    """
+    dates = set(dates)
+    return sorted(((f, entry) for (f, entry) in catalog.iteritems() \
+                       if entry['source'] == source_name and \
+                       entry['date'] in dates and \
+                       (kind is None or entry['kind'] == kind)), \
+                      key=lambda x: (x[1]['date'], x[0]))
+
+def formatArtifacts(source_name, artifacts):
+    """Format list of artifacts from findArtifacts for output."""
+    data = [['date', 'audit date', 'kind', 'file']]
+    for f, entry in artifacts:
+        data.append([entry['date'], entry['audit_date'], entry['kind'], \
+                         entry['path'] + f])
+    return '%s\n\n%s' % (source_name.upper(), formatTabularData(data))
+
+def rebuildCatalog(catalog_file, sources):
+    """Build catalog of audit artifacts from files already on disk.
+
+    Files are matched to sources by the filename bases set in params.
+    """
+    import os
+    catalog = {}
+    for source in sources:
+        data_bases = set(v[0] for v in source.data_filenames.itervalues())
+        paths = set([source.log_path, source.email_path, source.data_path, \
+                         source.viz_output_path, source.archive_path])
+        for path in paths:
+            try:
+                filenames = os.listdir(path)
+            except OSError:
+                continue
+            for f in filenames:
+                base = f.split('.')[0]
+                if f.endswith('.email') and base == source.email_filename:
+                    kind = 'email'
+                elif f.endswith('.bib.txt') and base in data_bases:
+                    kind = 'bib.txt'
+                elif f.endswith('.viz.sql') and \
+                        base.startswith(source.viz_output_filename + '_'):
+                    kind = 'viz.sql'
+                else:
+                    continue
+                try:
+                    date, audit_date = parseArtifactName(f)
+                except IndexError:
+                    continue
+                catalog[f] = {'source': source.name, 'kind': kind, 
+                              'date': date, 'audit_date': audit_date, 
+                              'path': path}
+    with lockedFile(catalog_file + '.lock'):
+        saveCatalog(catalog_file, catalog)
 
 def writeToDatabase(db_data, viz_sql_data):
     """Write stats to database for use by visualization service."""
@@ -483,7 +1971,7 @@ def writeToDatabase(db_data, viz_sql_data):
     c = db.cursor()
     query_dict = {}
     with db:
-        for filename, values in viz_sql_data.iteritems():
+        for values in viz_sql_data.itervalues():
             db_write = "REPLACE INTO Audit_Stats(Audit_Date, TimeStamp, Resource, Action, Extract, Error, `Load`, Filename) VALUES('%(audit_date)s', '%(timestamp)s', '%(resource)s', '%(action)s', %(extract)d, %(error)d, %(load)d, '%(filename)s');" % values
             c.execute(db_write)
             if values['action'] in query_dict:
@@ -493,10 +1981,13 @@ def writeToDatabase(db_data, viz_sql_data):
     return query_dict
 
 def writeSQLToFile(viz_path, filename_base, add_alt, extension, query_dict):
-    """Write SQL queries to file by action."""
+    """Write SQL queries to file by action. Return list of filenames."""
+    filenames = []
     for action, queries in query_dict.iteritems():
         filename = getFileNameTimestamp(filename_base + '_' + action + add_alt,\
                                             extension)
         with open(viz_path + filename, 'w') as fh:
             for q in queries:
                 fh.write(q + '\n\n\n')
+        filenames.append(filename)
+    return filenames
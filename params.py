@@ -28,6 +28,46 @@ default = {
         # Derived from information at:
         # https://nowontap.wordpress.com/2014/04/04/solr-exporting-an-index-to-an-external-file/
         'solr_url': 'http://localhost:8888/solr/collection/select?q=&start=0&rows=12000000&fl=id%2C+timestamp&wt=csv&indent=true',
+        # Seconds to wait for Solr to respond before retrying
+        'solr_timeout': 300,
+        # Number of times to resume Solr download after a dropped connection
+        'solr_retries': 3,
+        # Path for spooled Solr query results (downloaded before parsing)
+        'solr_spool_path': 'spool/',
+        # Export SolrCloud collection shard by shard with distrib=false
+        # None queries solr_url as a single request; 'discover' looks up one 
+        # active replica per shard from the collection's cluster status; or 
+        # list core URLs, e.g.
+        # ['http://host1:8983/solr/collection_shard1_replica1',
+        #  'http://host2:8983/solr/collection_shard2_replica1']
+        'solr_shards': None,
+        # Number of shards to export in parallel
+        'solr_shard_threads': 4,
+        # Seconds for which Solr query results are reused from a snapshot in 
+        # solr_spool_path by later runs (e.g. separate cron jobs per source)
+        # Not used for reruns with -d option
+        # None (no quotes) queries Solr on every run
+        'solr_cache_ttl': None,
+        # Filter query added to solr_url so only this source's records are 
+        # exported, e.g. regex on whole id 'id:/[0-9]+/' or source field 
+        # 'source:catalog'; should match the same ids as bib_pattern 
+        # anchored at the end of the id (e.g. '^\d+' for 'id:/[0-9]+/'), as 
+        # used to split a shared export
+        # None (no quotes) exports all records in solr_url
+        'solr_filter': None,
+        # Sources sharing solr_url split one full export between them by 
+        # bib_pattern instead of exporting separately if their filtered 
+        # queries together match at least this share of all records
+        # None (no quotes) always exports separately
+        'solr_split_share': 0.9,
+        # Unsuccessful bibs are re-queried with real-time get before being 
+        # reported as errors, again after a wait while each re-query finds 
+        # more bibs updated; maximum total seconds to wait
+        # None (no quotes) reports errors from the Solr export unverified
+        'solr_verify_wait': 60,
+        # Seconds to wait before second re-query (doubles for each further 
+        # re-query)
+        'solr_verify_interval': 10,
         # Path for log output
         'log_path': 'logs/',
         # Filename for log file (output will append)
@@ -53,8 +93,50 @@ default = {
             'solr_deleted': (None, False),
             'solr_not_added': (None, False),
             'solr_not_deleted': (None, False)},
+        # Add column to data files naming the extract file each bib came from
+        # (True or False)
+        'data_by_file': False,
+        # Filename for ledger of bibs not added or not deleted, kept in log_path
+        # Outstanding bibs are rechecked against Solr at most once a day, on 
+        # runs that produce output, until resolved
+        # Set in individual datasource parameters
+        'outstanding_file': None,
+        # Days after audit date to stop rechecking an outstanding bib
+        # None (no quotes) rechecks until resolved
+        'outstanding_max_age': 30,
+        # Sampling audit for large extracts (e.g. full reloads): a random sample
+        # of each extract file is verified with targeted Solr queries instead 
+        # of the full Solr export, and stats report estimated results
+        # Number of extract bibs at which sampling is used
+        # None (no quotes) always runs full audit
+        'sample_min_extract': None,
+        # Number of bibs sampled from each extract file
+        'sample_size': 2000,
+        # Full audit is run instead if the upper 95% confidence bound of the 
+        # estimated error rate is above this value
+        'sample_max_error_rate': 0.01,
+        # Compare each extract file to Solr as it is read and write results 
+        # to data files as they are found, keeping only errors in memory
+        # (True or False, no quotes; ignored if sample_min_extract is set)
+        'streaming': False,
         # Path for archived files
         'archive_path': 'archive/',
+        # Path and filename for catalog of email, data and visualization files
+        # (used to look up files for -r and -o command line options)
+        # Sources may share a catalog
+        'catalog_path': 'logs/',
+        'catalog_file': 'audit_catalog.json',
+        # Path for checkpoints of audits in progress (used to resume an 
+        # incomplete audit with the -c command line option)
+        'checkpoint_path': 'checkpoints/',
+        # Path and filename for history of bib ids audited (SQLite database, 
+        # queried with the -b command line option); sources may share a file
+        # history_file None (no quotes) disables the bib history store
+        'history_path': 'logs/',
+        'history_file': 'bib_history.sqlite',
+        # Days of bib history kept when compacted with the -k command line 
+        # option; the most recent audit of each bib id is always kept
+        'history_keep_days': 365,
         # Path for email file output (backup of email notification)
         'email_path': 'logs/',
         # Filename for email backup file
@@ -119,6 +201,16 @@ config = [
         'skip_MFHDs': True,
         'bib_pattern': '^\d+',
         'solr_url': default['solr_url'],
+        'solr_timeout': default['solr_timeout'],
+        'solr_retries': default['solr_retries'],
+        'solr_spool_path': default['solr_spool_path'],
+        'solr_shards': default['solr_shards'],
+        'solr_shard_threads': default['solr_shard_threads'],
+        'solr_cache_ttl': default['solr_cache_ttl'],
+        'solr_filter': 'id:/[0-9]+/',
+        'solr_split_share': default['solr_split_share'],
+        'solr_verify_wait': default['solr_verify_wait'],
+        'solr_verify_interval': default['solr_verify_interval'],
         'log_path': default['log_path'],
         'log_file': default['log_file'],
         'log_if_none': default['log_if_none'],
@@ -130,7 +222,20 @@ config = [
             'solr_deleted': ('source1_del_success', True),
             'solr_not_added': ('source1_add_error', True),
             'solr_not_deleted': ('source1_del_error', True)},
+        'data_by_file': default['data_by_file'],
+        'outstanding_file': 'source1_outstanding.txt',
+        'outstanding_max_age': default['outstanding_max_age'],
+        'sample_min_extract': default['sample_min_extract'],
+        'sample_size': default['sample_size'],
+        'sample_max_error_rate': default['sample_max_error_rate'],
+        'streaming': default['streaming'],
         'archive_path': default['archive_path'],
+        'catalog_path': default['catalog_path'],
+        'catalog_file': default['catalog_file'],
+        'checkpoint_path': default['checkpoint_path'],
+        'history_path': default['history_path'],
+        'history_file': default['history_file'],
+        'history_keep_days': default['history_keep_days'],
         'email_path': default['email_path'],
         'email_filename': 'source1',
         'email_recipients': default['email_recipients'],
@@ -173,6 +278,16 @@ config = [
         'bib_pattern': '^b\d+',
         'skip_MFHDs': False,
         'solr_url': default['solr_url'],
+        'solr_timeout': default['solr_timeout'],
+        'solr_retries': default['solr_retries'],
+        'solr_spool_path': default['solr_spool_path'],
+        'solr_shards': default['solr_shards'],
+        'solr_shard_threads': default['solr_shard_threads'],
+        'solr_cache_ttl': default['solr_cache_ttl'],
+        'solr_filter': 'id:/b[0-9]+/',
+        'solr_split_share': default['solr_split_share'],
+        'solr_verify_wait': default['solr_verify_wait'],
+        'solr_verify_interval': default['solr_verify_interval'],
         'log_path': default['log_path'],
         'log_file': default['log_file'],
         'log_if_none': default['log_if_none'],
@@ -184,7 +299,20 @@ config = [
             'solr_deleted': ('source2_del_success', True),
             'solr_not_added': ('source2_add_error', True),
             'solr_not_deleted': ('source2_del_error', True)},
+        'data_by_file': default['data_by_file'],
+        'outstanding_file': 'source2_outstanding.txt',
+        'outstanding_max_age': default['outstanding_max_age'],
+        'sample_min_extract': default['sample_min_extract'],
+        'sample_size': default['sample_size'],
+        'sample_max_error_rate': default['sample_max_error_rate'],
+        'streaming': default['streaming'],
         'archive_path': default['archive_path'],
+        'catalog_path': default['catalog_path'],
+        'catalog_file': default['catalog_file'],
+        'checkpoint_path': default['checkpoint_path'],
+        'history_path': default['history_path'],
+        'history_file': default['history_file'],
+        'history_keep_days': default['history_keep_days'],
         'email_path': default['email_path'],
         'email_filename': 'source2',
         'email_recipients': default['email_recipients'],